@@ -12,17 +12,23 @@ import curses
 import fcntl
 import gettext
 import glob
+import hashlib
+import itertools
 import locale
+import logging
 import os
-import random
-import stat
+import re
 import struct
 import sys
+import tempfile
 import termios
 import threading
 import time
 from argparse import ArgumentParser
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 from signal import SIGINT, SIGTERM, SIGWINCH, signal
 from types import FrameType
@@ -31,7 +37,6 @@ from urllib.parse import urlparse
 
 from OPSI import __version__ as python_opsi_version  # type: ignore
 from OPSI.UI import SnackUI  # type: ignore[import]
-from OPSI.Util import md5sum  # type: ignore[import]
 from OPSI.Util.File.Opsi import parseFilename  # type: ignore[import]
 from OPSI.Util.Message import (  # type: ignore[import]
 	MessageSubject,
@@ -39,7 +44,7 @@ from OPSI.Util.Message import (  # type: ignore[import]
 	Subject,
 	SubjectsObserver,
 )
-from OPSI.Util.Repository import getRepository  # type: ignore[import]
+from OPSI.Util.Repository import Repository, getRepository  # type: ignore[import]
 from opsicommon.client.opsiservice import ServiceClient
 from opsicommon.config import OpsiConfig
 from opsicommon.logging import (
@@ -49,7 +54,7 @@ from opsicommon.logging import (
 	get_logger,
 	logging_config,
 )
-from opsicommon.objects import Product, ProductOnDepot, ProductProperty
+from opsicommon.objects import OpsiDepotserver, Product, ProductOnDepot, ProductProperty
 from opsicommon.package import OpsiPackage
 from opsicommon.types import (
 	forceActionRequest,
@@ -74,6 +79,62 @@ logger = get_logger("opsi-package-manager")
 
 USER_AGENT = f"opsi-package-manager/{__version__}"
 
+USAGE = """
+Usage: {prog} [options] <command>
+
+Manage opsi packages
+
+Commands:
+  -i, --install      <opsi-package> ...      install opsi packages
+  -u, --upload       <opsi-package> ...      upload opsi packages to repositories
+  -l, --list         <regex>                 list opsi packages matching regex
+  -D, --differences  <regex>                 show depot differences of opsi packages matching regex
+  -r, --remove       <opsi-product-id> ...   uninstall opsi packages
+      --purge        [opsi-product-id] ...   uninstall opsi packages and purge product data
+                                             if no products are specified, purge the product data
+                                             of all products that are not installed
+  -R, --repo-remove  <opsi-product-id> ...   remove opsi packages from local repository
+  -x, --extract      <opsi-package> ...      extract opsi packages to local directory
+  -V, --version                              show program's version info and exit
+  -h, --help                                 show this help message and exit
+
+Options:
+  -v, --verbose                           increase verbosity (can be used multiple times)
+  -q, --quiet                             do not display any messages
+  --log-file         <log-file>           path to debug log file
+  --log-file-level   <log-file-level>     log file level (default 4)
+  -d, --depots       <depots>             comma separated list of depot ids to process
+                                      all = all known depots
+  -p, --properties   <mode>               mode for default product property values
+                                  ask     = display dialog
+                                  package = use defaults from package
+	                                 keep    = keep depot defaults (default)
+  --purge-client-properties               remove product property states of the installed product(s)
+  -f, --force                             force install/uninstall (use with extreme caution)
+  -U, --update                            set action "update" on hosts where installation status is "installed"
+  -S, --setup                             set action "setup" on hosts where installation status is "installed"
+  -s, --setup-with-dependencies           set action "setup" on hosts where installation status is "installed" with dependencies
+  -o, --overwrite                         overwrite existing package on upload even if size matches
+  -n, --no-delta                          full package transfers on uploads (do not use librsync)
+  --delta-min-size   <kbytes>             minimum package size for delta uploads (default = 32768)
+  -k, --keep-files                        do not delete client data dir on uninstall
+  -t, --temp-dir     <path>               tempory directory for package install
+  --max-transfers    <num>                maximum number of simultaneous uploads
+                                             0 = unlimited (default = 20)
+  --max-bandwidth    <kbps>               maximum transfer rate for each transfer (in kilobytes per second)
+                                             0 = unlimited (default = 0)
+  --new-product-id   <product-id>         Set a new product id when extracting opsi package or
+                                          set a specific product ID during installation.
+  --suppress-pcf-generation               Suppress the generation of a package content file during package
+                                          installation. Do not use with WAN extension!
+
+"""
+
+# Removes line breaks and tabs, which would break the list layout
+CONTROL_CHARS_TABLE = str.maketrans("", "", "\n\r\t")
+# Delta uploads are only used if the delta is smaller than this fraction of the package
+DELTA_MAX_SIZE_RATIO = 0.9
+
 try:
 	sp = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 	if os.path.exists(os.path.join(sp, "site-packages")):
@@ -129,9 +190,9 @@ class UploadTask(Task):
 		Task.__init__(self, name, opsiPackageManager, method, params)
 
 	def start(self) -> None:
-		while self.opsiPackageManager.maxTransfersReached():
+		if self.opsiPackageManager.maxTransfersReached():
 			logger.debug("Maximum number transfers reached, waiting")
-			time.sleep(1)
+			self.opsiPackageManager.waitForFreeTransferSlot()
 		Task.start(self)
 
 	def abort(self) -> None:
@@ -148,6 +209,14 @@ class UninstallTask(Task):
 		Task.__init__(self, name, opsiPackageManager, method, params)
 
 
+class DeltaFile:
+	def __init__(self) -> None:
+		self.path: str | None = None
+		self.ready = False
+		self.users = 0
+		self.lock = threading.Lock()
+
+
 class CursesWindow:
 	def __init__(self, height: int, width: int, y: int, x: int, title: str = "", border: bool = False) -> None:
 		self.height = forceInt(height)
@@ -208,11 +277,13 @@ class CursesWindow:
 		self.win.idlok(scrollable)
 
 	def addstr(self, _str: str, attr: int | None = None) -> None:
+		if not isinstance(_str, str):
+			_str = forceUnicode(_str)
 		try:
 			if attr:
-				self.win.addstr(forceUnicode(_str), attr)
+				self.win.addstr(_str, attr)
 			else:
-				self.win.addstr(forceUnicode(_str))
+				self.win.addstr(_str)
 		except Exception:
 			pass
 
@@ -283,19 +354,22 @@ class CursesMainWindow(CursesWindow):
 class CursesTextWindow(CursesWindow):
 	def __init__(self, height: int, width: int, y: int, x: int, title: str = "", border: bool = False):
 		CursesWindow.__init__(self, height, width, y, x, title, border)
-		self.lines: list[tuple[str, tuple[int, ...]]] = []
+		# Only the last lines which fit into the window are kept
+		self.lines: deque[tuple[str, tuple[int, ...]]] = deque(maxlen=max(1, self.height))
 		self._lock = threading.Lock()
 
 	def addLine(self, line: str, *params: int) -> None:
-		line = forceUnicode(line)
+		if not isinstance(line, str):
+			line = forceUnicode(line)
 		with self._lock:
 			if len(line) > self.width:
 				line = line[: self.width - 1]
-				self.lines.append((line, params))
+			self.lines.append((line, params))
 			self.build()
 
 	def addLines(self, lines: list[str], *params: int) -> None:
-		lines = forceStringList(lines)
+		if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+			lines = forceStringList(lines)
 		with self._lock:
 			for line in lines:
 				if len(line) > self.width:
@@ -304,9 +378,10 @@ class CursesTextWindow(CursesWindow):
 			self.build()
 
 	def setLines(self, lines: list[str], *params: int) -> None:
-		lines = forceStringList(lines)
+		if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+			lines = forceStringList(lines)
 		with self._lock:
-			self.lines = []
+			self.lines.clear()
 			for line in lines:
 				if len(line) > self.width:
 					line = line[: self.width - 1]
@@ -314,12 +389,9 @@ class CursesTextWindow(CursesWindow):
 			self.build()
 
 	def getLines(self) -> list[tuple[str, tuple[int, ...]]]:
-		return self.lines
+		return list(self.lines)
 
 	def build(self) -> None:
-		if len(self.lines) > self.height:
-			self.lines = self.lines[-1 * self.height :]
-
 		for idx, (line, params) in enumerate(self.lines):
 			if idx >= self.height:
 				return
@@ -333,7 +405,7 @@ class CursesTextWindow(CursesWindow):
 
 	def resize(self, height: int, width: int, y: int, x: int) -> None:
 		CursesWindow.resize(self, height, width, y, x)
-		newLines = []
+		newLines: deque[tuple[str, tuple[int, ...]]] = deque(maxlen=max(1, self.height))
 		for line, params in self.lines:
 			if len(line) > self.width:
 				line = line[: self.width - 1]
@@ -347,8 +419,41 @@ class UserInterface(SubjectsObserver):
 		self.config = config or {}
 		self.opmSubjects: list[Subject] = subjects or []
 		self.mainWindow: CursesMainWindow | None = None
+		self._progressDirty = threading.Event()
+		self._progressThread: threading.Thread | None = None
+		self._progressSubjects: tuple[list[Subject], int] = ([], 0)
+		self._progressSubjectsLock = threading.Lock()
 		self.initScreen()
 
+	def setSubjects(self, subjects: list[Subject]) -> None:
+		SubjectsObserver.setSubjects(self, subjects)
+		self._updateProgressSubjects()
+
+	def addSubject(self, subject: Subject) -> None:
+		SubjectsObserver.addSubject(self, subject)
+		self._updateProgressSubjects()
+
+	def removeSubject(self, subject: Subject) -> None:
+		SubjectsObserver.removeSubject(self, subject)
+		self._updateProgressSubjects()
+
+	def _updateProgressSubjects(self) -> None:
+		with self._progressSubjectsLock:
+			subjects = {}
+			for subject in self.getSubjects():
+				if subject.getType() == "depot":
+					subjects[subject.getId()] = subject
+
+			# Upload progress replaces the depot line
+			for subject in self.getSubjects():
+				if subject.getType() == "upload":
+					subjects[subject.getId()] = subject
+
+			ids = sorted(subjects)
+			maxIdLength = max((len(currentID) for currentID in ids), default=0)
+			self._progressSubjects = ([subjects[currentID] for currentID in ids], maxIdLength)
+		self.showProgress()
+
 	def initScreen(self) -> None:
 		# Important for ncurses to use the right encoding!?
 		try:
@@ -364,7 +469,10 @@ class UserInterface(SubjectsObserver):
 			self.loggerWindowHeight = 5
 
 		self._colors = {}
-		self.__lock = threading.Lock()
+		# One lock per window, windows can be updated independently
+		self._infoLock = threading.Lock()
+		self._progressLock = threading.Lock()
+		self._loggerLock = threading.Lock()
 
 		self.mainWindow = CursesMainWindow()
 		self.infoWindow = CursesTextWindow(height=1, width=self.mainWindow.width, x=0, y=0)
@@ -415,6 +523,9 @@ class UserInterface(SubjectsObserver):
 
 		self.mainWindow.refresh()
 
+		self._progressThread = threading.Thread(target=self._progressLoop, name="ProgressRefresher", daemon=True)
+		self._progressThread.start()
+
 		self.setSubjects(self.opmSubjects)
 
 		signal(SIGWINCH, self.resized)
@@ -454,11 +565,10 @@ class UserInterface(SubjectsObserver):
 		if not message:
 			logger.warning("Message deleted: %s %s", subject.getType(), subject.getId())
 
-		if self.__lock.locked():
-			return
-
 		if subject.getType() == "Logger" and self.loggerWindow:
-			with self.__lock:
+			if not self._loggerLock.acquire(blocking=False):
+				return
+			try:
 				# Do not log anything to avoid log loops !!!
 				params = []
 				ll = subject.getSeverity()
@@ -466,9 +576,11 @@ class UserInterface(SubjectsObserver):
 					params = [self._colors[ll]]
 				self.loggerWindow.addLines(message.split("\n"), *params)
 				self.loggerWindow.refresh()
+			finally:
+				self._loggerLock.release()
 
 		elif subject.getId() in ("info", "transfers"):
-			with self.__lock:
+			with self._infoLock:
 				info = ""
 				transfers = ""
 				for subj in self.getSubjects():
@@ -477,9 +589,8 @@ class UserInterface(SubjectsObserver):
 					elif subj.getId() == "transfers":
 						transfers = subj.getMessage()
 
-				free = self.infoWindow.width - len(info) - len(transfers) - 1
-				free = max(free, 0)
-				self.infoWindow.setLines([info + " " * free + transfers])
+				infoWidth = max(self.infoWindow.width - len(transfers) - 1, 0)
+				self.infoWindow.setLines([f"{info:<{infoWidth}}{transfers}"])
 				self.infoWindow.refresh()
 		else:
 			self.showProgress()
@@ -491,32 +602,42 @@ class UserInterface(SubjectsObserver):
 
 	def exitScreen(self) -> None:
 		logger.debug("UserInterface: exitScreen()")
+		progressThread = self._progressThread
+		self._progressThread = None
+		if progressThread:
+			# Wake up the refresher thread to let it terminate
+			self._progressDirty.set()
+			if progressThread is not threading.current_thread():
+				progressThread.join(1)
 		if not self.mainWindow:
 			return
 		self.mainWindow.exitScreen()
 		self.mainWindow = None
 
-	def showProgress(self) -> None:
-		if self.__lock.locked():
-			return
-
-		with self.__lock:
-			subjects = {}
-			for subject in self.getSubjects():
-				if subject.getType() == "depot":
-					subjects[subject.getId()] = subject
+	def _progressLoop(self) -> None:
+		thread = threading.current_thread()
+		while self._progressThread is thread:
+			self._progressDirty.wait()
+			if self._progressThread is not thread:
+				break
+			# Coalesce progress changes, redraw at most 20 times per second
+			time.sleep(0.05)
+			self._progressDirty.clear()
+			try:
+				self._showProgress()
+			except Exception as err:
+				logger.trace(err)
 
-			for subject in self.getSubjects():
-				if subject.getType() == "upload":
-					subjects[subject.getId()] = subject
+	def showProgress(self) -> None:
+		# Progress is drawn by the refresher thread
+		self._progressDirty.set()
 
-			ids = list(subjects.keys())
-			ids.sort()
-			maxIdLength = max([len(currentID) for currentID in ids] or [0])
+	def _showProgress(self) -> None:
+		with self._progressLock:
+			progressSubjects, maxIdLength = self._progressSubjects
 
 			y = 0
-			for currentID in ids:
-				subject = subjects[currentID]
+			for subject in progressSubjects:
 				if y >= self.progressWindow.height:
 					# Screen full
 					logger.debug("Screen to small to display all progresses")
@@ -540,7 +661,7 @@ class UserInterface(SubjectsObserver):
 					if severity and severity in self._colors:
 						color = self._colors[severity]
 
-					if subject.getClass() == "ProgressSubject":
+					if isinstance(subject, ProgressSubject):
 						minutes_left = f"{int(subject.getTimeLeft() / 60):02}"
 						seconds_left = f"{int(subject.getTimeLeft() % 60):02}"
 						percent = f"{subject.getPercent():.2f}"
@@ -549,8 +670,8 @@ class UserInterface(SubjectsObserver):
 							f"KB{(int(subject.getSpeed() / 1000)):>6} KB/s"
 							f"{minutes_left:>6}:{seconds_left} ETA"
 						)
-						free = max(maxSize - len(message) - len(progress), 0)
-						message = message + " " * free + progress
+						messageWidth = max(maxSize - len(progress), 0)
+						message = f"{message:<{messageWidth}}{progress}"
 
 					if len(message) > maxSize:
 						message = message[:maxSize]
@@ -574,11 +695,13 @@ class TaskQueue(threading.Thread):
 		self.tasks: list[Task] = []
 		self.started = False
 		self.ended = False
+		self.endedEvent = threading.Event()
 		self.errors: list[Exception] = []
 		self.currentTaskNumber = -1
 
 	def abort(self) -> None:
 		self.ended = True
+		self.endedEvent.set()
 		task = self.getCurrentTask()
 		if task:
 			task.abort()
@@ -594,31 +717,29 @@ class TaskQueue(threading.Thread):
 			raise RuntimeError("No tasks in queue")
 		self.started = True
 		logger.debug("TaskQueue '%s' started", self.name)
-		i = 0
-		while i < len(self.tasks):
-			if self.ended:
-				return
+		try:
+			i = 0
+			while i < len(self.tasks):
+				if self.ended:
+					return
 
-			task = self.tasks[i]
-			try:
-				logger.debug("Starting task '%s'", task.name)
-				self.currentTaskNumber += 1
-				task.start()
-				logger.debug("Task '%s' ended", task.name)
-			except Exception as err:
-				logger.error("Task '%s' failed: %s", task.name, err)
-				self.errors.append(err)
-				if i < (len(self.tasks) - 1) and isinstance(task, UploadTask) and isinstance(self.tasks[i + 1], InstallTask):
-					# Upload task failed => do not execute install task
-					logger.notice("Upload task failed, skipping install task")
-					i += 1
-			if i < len(self.tasks) - 1:
-				time.sleep(2)
-				if isinstance(task, UploadTask) and isinstance(self.tasks[i + 1], UploadTask):
-					# Waiting a little more to provide the opportunity to start other upload tasks
-					time.sleep(2)
-			i += 1
-		self.ended = True
+				task = self.tasks[i]
+				try:
+					logger.debug("Starting task '%s'", task.name)
+					self.currentTaskNumber += 1
+					task.start()
+					logger.debug("Task '%s' ended", task.name)
+				except Exception as err:
+					logger.error("Task '%s' failed: %s", task.name, err)
+					self.errors.append(err)
+					if i < (len(self.tasks) - 1) and isinstance(task, UploadTask) and isinstance(self.tasks[i + 1], InstallTask):
+						# Upload task failed => do not execute install task
+						logger.notice("Upload task failed, skipping install task")
+						i += 1
+				i += 1
+		finally:
+			self.ended = True
+			self.endedEvent.set()
 
 	def addTask(self, task: Task) -> None:
 		if not isinstance(task, Task):
@@ -635,7 +756,8 @@ class OpsiPackageManager:
 		self.userInterface = None
 		self.taskQueues: list[TaskQueue] = []
 		self.productPackageFiles: dict[str, OpsiPackage] = {}
-		self.productPackageFileMd5sums: dict[str, str] = {}
+		self.productPackageFileMd5sums: dict[tuple[str, int], str] = {}
+		self.productPackageFileMd5sumLocks: dict[tuple[str, int], threading.Lock] = {}
 		self.runningTransfers = 0
 
 		self.infoSubject = MessageSubject("info")
@@ -645,10 +767,19 @@ class OpsiPackageManager:
 		self.productPackageFilesLock = threading.Lock()
 		self.productPackageFilesMd5sumLock = threading.Lock()
 		self.runningTransfersLock = threading.Lock()
+		self.runningTransfersCondition = threading.Condition(self.runningTransfersLock)
 
 		self.infoSubject.setMessage("opsi-package-manager")
 
 		self.depotConnections: dict[str, ServiceClient] = {}
+		self.depotRepositories: dict[str, Repository] = {}
+		self.depotObjects: dict[str, OpsiDepotserver] = {}
+		self.deltaFiles: dict[tuple[str, bytes], DeltaFile] = {}
+		self.deltaFilesLock = threading.Lock()
+		self.depotObjectsLock = threading.Lock()
+		self.depotRepositoriesLock = threading.Lock()
+		self.repositoryIndexes: dict[str, dict[str, dict[str, dict[str, Any]]]] = {}
+		self.repositoryIndexesLock = threading.Lock()
 
 		if not self.config["quiet"]:
 			logging_config(stderr_level=LOG_NONE)
@@ -657,6 +788,9 @@ class OpsiPackageManager:
 
 	def abort(self) -> None:
 		self.aborted = True
+		with self.runningTransfersCondition:
+			# Wake up tasks waiting for a transfer slot
+			self.runningTransfersCondition.notify_all()
 		running = True
 		while running:
 			running = False
@@ -675,12 +809,30 @@ class OpsiPackageManager:
 		for connection in self.depotConnections.values():
 			connection.disconnect()
 
+		for depotId, repository in self.depotRepositories.items():
+			logger.debug("Closing repository connection to depot '%s'", depotId)
+			try:
+				repository.disconnect()
+			except Exception as err:
+				logger.error("Failed to disconnect from repository: %s", err, exc_info=True)
+
+	def getDepot(self, depotId: str) -> OpsiDepotserver:
+		with self.depotObjectsLock:
+			if depotId not in self.depotObjects:
+				# Fetch all depots to process with a single call
+				depotIds = list(self.config["depotIds"] or [])
+				if depotId not in depotIds:
+					depotIds.append(depotId)
+				for depot in self.service_client.jsonrpc("host_getObjects", [[], {"type": "OpsiDepotserver", "id": depotIds}]):
+					self.depotObjects[depot.id] = depot
+			return self.depotObjects[depotId]
+
 	def getDepotConnection(self, depotId: str) -> ServiceClient:
 		try:
 			connection = self.depotConnections[depotId]
 		except KeyError:
 			logger.info("Establishing connection to depot %s", depotId)
-			depot = self.service_client.jsonrpc("host_getObjects", [[], {"type": "OpsiDepotserver", "id": depotId}])[0]
+			depot = self.getDepot(depotId)
 
 			url = urlparse(depot.repositoryRemoteUrl)
 			hostname = url.hostname
@@ -698,13 +850,66 @@ class OpsiPackageManager:
 
 		return connection
 
+	def getDepotRepository(self, depotId: str, depot: OpsiDepotserver) -> Repository:
+		"""
+		Returns the repository of the depot.
+		The repository is kept open to reuse the connection for all packages.
+		"""
+		with self.depotRepositoriesLock:
+			try:
+				return self.depotRepositories[depotId]
+			except KeyError:
+				pass
+
+			logger.info("Using '%s' as repository url", depot.repositoryRemoteUrl)
+			maxBandwidth = max(depot.maxBandwidth or 0, 0)
+			if not maxBandwidth and self.config["maxBandwidth"]:
+				maxBandwidth = self.config["maxBandwidth"]
+			if maxBandwidth:
+				logger.info("Setting max bandwidth for depot '%s' to %d kBytes/s", depotId, maxBandwidth)
+
+			repository = getRepository(
+				url=depot.repositoryRemoteUrl,
+				username=depotId,
+				password=depot.opsiHostKey,
+				maxBandwidth=maxBandwidth * 1000,
+				application=USER_AGENT,
+				readTimeout=24 * 3600,  # Upload can take a long time
+			)
+			self.depotRepositories[depotId] = repository
+			return repository
+
+	def getRepositoryIndex(self, depotId: str, repository: Repository) -> dict[str, dict[str, dict[str, Any]]]:
+		"""
+		Returns the repository content of the depot as {productId: {filename: fileInfo}}.
+		The content is listed once and kept until the repository is modified.
+		"""
+		with self.repositoryIndexesLock:
+			index = self.repositoryIndexes.get(depotId)
+		if index is not None:
+			return index
+
+		index = {}
+		for dest in repository.content():
+			fileInfo = _parse_filename(dest["name"])
+			if fileInfo:
+				index.setdefault(fileInfo.productId, {})[dest["name"]] = dest
+		with self.repositoryIndexesLock:
+			self.repositoryIndexes[depotId] = index
+		return index
+
+	def invalidateRepositoryIndex(self, depotId: str) -> None:
+		with self.repositoryIndexesLock:
+			self.repositoryIndexes.pop(depotId, None)
+
 	def getRunningTransfers(self) -> int:
 		with self.runningTransfersLock:
 			return self.runningTransfers
 
 	def setRunningTransfers(self, num: int) -> None:
-		with self.runningTransfersLock:
+		with self.runningTransfersCondition:
 			self.runningTransfers = num
+			self.runningTransfersCondition.notify_all()
 		self.updateRunningTransfersSubject()
 
 	def addRunningTransfer(self) -> None:
@@ -713,8 +918,27 @@ class OpsiPackageManager:
 		self.updateRunningTransfersSubject()
 
 	def removeRunningTransfer(self) -> None:
-		with self.runningTransfersLock:
+		with self.runningTransfersCondition:
 			self.runningTransfers -= 1
+			self.runningTransfersCondition.notify()
+		self.updateRunningTransfersSubject()
+
+	def _transferSlotAvailable(self) -> bool:
+		# Must be called with runningTransfersLock held
+		return self.aborted or not self.config["maxTransfers"] or self.runningTransfers < self.config["maxTransfers"]
+
+	def waitForFreeTransferSlot(self) -> None:
+		with self.runningTransfersCondition:
+			self.runningTransfersCondition.wait_for(self._transferSlotAvailable)
+		if self.aborted:
+			raise RuntimeError("Aborted")
+
+	def acquireTransferSlot(self) -> None:
+		with self.runningTransfersCondition:
+			self.runningTransfersCondition.wait_for(self._transferSlotAvailable)
+			if self.aborted:
+				raise RuntimeError("Aborted")
+			self.runningTransfers += 1
 		self.updateRunningTransfersSubject()
 
 	def updateRunningTransfersSubject(self) -> None:
@@ -744,13 +968,22 @@ class OpsiPackageManager:
 		return self.depotSubjects[depotId]
 
 	def openProductPackageFile(self, packageFile: Path) -> None:
-		temp_dir = None
-		if self.config.get("tempDir"):
-			temp_dir = Path(str(self.config["tempDir"]))
 		with self.productPackageFilesLock:
-			if packageFile.name not in self.productPackageFiles:
-				self.infoSubject.setMessage(_("Opening package file %s") % packageFile.name)
-				self.productPackageFiles[packageFile.name] = OpsiPackage(packageFile, temp_dir=temp_dir)
+			if packageFile.name in self.productPackageFiles:
+				return
+		# Parse outside of the lock to allow opening multiple package files in parallel
+		self.infoSubject.setMessage(_("Opening package file %s") % packageFile.name)
+		opsiPackage = get_opsi_package(packageFile, self.config.get("tempDir"))
+		with self.productPackageFilesLock:
+			self.productPackageFiles.setdefault(packageFile.name, opsiPackage)
+
+	def openProductPackageFiles(self, packageFiles: list[str]) -> None:
+		if len(packageFiles) <= 1:
+			for packageFile in packageFiles:
+				self.openProductPackageFile(Path(packageFile))
+			return
+		with ThreadPoolExecutor(max_workers=min(8, len(packageFiles))) as executor:
+			list(executor.map(self.openProductPackageFile, [Path(packageFile) for packageFile in packageFiles]))
 
 	def getOpsiPackage(self, packageFile: str) -> OpsiPackage:
 		filename = os.path.basename(packageFile)
@@ -761,26 +994,65 @@ class OpsiPackageManager:
 			return self.productPackageFiles[filename]
 
 	def getPackageMd5Sum(self, packageFile: str) -> str:
-		filename = os.path.basename(packageFile)
+		# A package file rebuilt in place while running gets a new checksum
+		filename = (os.path.abspath(packageFile), os.stat(packageFile).st_mtime_ns)
 		with self.productPackageFilesMd5sumLock:
 			try:
-				checksum = self.productPackageFileMd5sums[filename]
+				return self.productPackageFileMd5sums[filename]
 			except KeyError:
-				checksum = md5sum(packageFile)
-				self.productPackageFileMd5sums[filename] = checksum
-
-			return checksum
+				fileLock = self.productPackageFileMd5sumLocks.setdefault(filename, threading.Lock())
+
+		# Only uploads of the same package file have to wait for each other
+		with fileLock:
+			with self.productPackageFilesMd5sumLock:
+				checksum = self.productPackageFileMd5sums.get(filename)
+			if not checksum:
+				checksum = file_md5sum(packageFile)
+				with self.productPackageFilesMd5sumLock:
+					self.productPackageFileMd5sums[filename] = checksum
+		return checksum
+
+	def acquireDeltaFile(self, key: tuple[str, bytes], packageFile: str, signature: bytes) -> str:
+		"""
+		Returns the librsync delta of the package file for the signature.
+		Depots holding the same old package share the delta, it is only calculated once.
+		Every call has to be followed by a call to releaseDeltaFile, also on error.
+		"""
+		with self.deltaFilesLock:
+			deltaFile = self.deltaFiles.get(key)
+			if not deltaFile:
+				deltaFile = self.deltaFiles[key] = DeltaFile()
+			deltaFile.users += 1
+
+		with deltaFile.lock:
+			if not deltaFile.path:
+				fd, path = tempfile.mkstemp(prefix=f"{os.path.basename(packageFile)}.", suffix=".delta")
+				os.close(fd)
+				deltaFile.path = path
+				librsyncDeltaFile(packageFile, signature, path)
+				deltaFile.ready = True
+			elif not deltaFile.ready:
+				raise RuntimeError(f"Failed to calculate delta for '{packageFile}'")
+			return deltaFile.path
+
+	def releaseDeltaFile(self, key: tuple[str, bytes]) -> None:
+		with self.deltaFilesLock:
+			deltaFile = self.deltaFiles[key]
+			deltaFile.users -= 1
+			if deltaFile.users > 0:
+				return
+			del self.deltaFiles[key]
+		if deltaFile.path and os.path.exists(deltaFile.path):
+			os.unlink(deltaFile.path)
 
 	def waitForTaskQueues(self) -> None:
 		self.infoSubject.setMessage(_("Waiting for task queues to finish up"))
-		running = 1
-		while running:
-			running = 0
-			for tq in self.taskQueues:
-				if not tq.ended:
-					running += 1
-			self.infoSubject.setMessage(_("%d/%d task queues running") % (running, len(self.taskQueues)))
-			time.sleep(1)
+		while True:
+			running = [tq for tq in self.taskQueues if not tq.ended]
+			self.infoSubject.setMessage(_("%d/%d task queues running") % (len(running), len(self.taskQueues)))
+			if not running:
+				break
+			running[0].endedEvent.wait()
 
 	def getTaskQueueErrors(self) -> dict[str, list[Exception]]:
 		errors = {}
@@ -795,9 +1067,10 @@ class OpsiPackageManager:
 			subject = self.getDepotSubject(depotId)
 			subject.setMessage(_("Setting action setup for product %s where installed") % productId)
 			actionRequest = forceActionRequest(actionRequest)
-			clientIds = []
-			for clientToDepot in self.service_client.jsonrpc("configState_getClientToDepotserver", [[depotId]]):
-				clientIds.append(clientToDepot["clientId"])
+			clientIds = [
+				clientToDepot["clientId"]
+				for clientToDepot in self.service_client.jsonrpc("configState_getClientToDepotserver", [[depotId]])
+			]
 
 			if not clientIds:
 				return
@@ -809,20 +1082,23 @@ class OpsiPackageManager:
 				return
 
 			if dependency:
-				for client in [x.clientId for x in productOnClients]:
+
+				def setActionRequestWithDependencies(client: str) -> None:
 					logger.notice("Setting action '%s' with Dependencies for product '%s' on client: %s", actionRequest, productId, client)
 					subject.setMessage(
 						_("Setting action %s with Dependencies for product %s on client: %s") % (actionRequest, productId, client)
 					)
 					self.service_client.jsonrpc("setProductActionRequestWithDependencies", [productId, client, actionRequest])
+
+				# One call per client, run the calls concurrently
+				clients = [x.clientId for x in productOnClients]
+				with ThreadPoolExecutor(max_workers=min(10, len(clients))) as executor:
+					list(executor.map(setActionRequestWithDependencies, clients))
 				return
 
-			clientIds = []
 			for poc in productOnClients:
 				poc.actionRequest = actionRequest
-				clientIds.append(poc.clientId)
-
-			clientIds.sort()
+			clientIds = sorted(poc.clientId for poc in productOnClients)
 			logger.notice("Setting action '%s' for product '%s' on client(s): %s", actionRequest, productId, ", ".join(clientIds))
 			subject.setMessage(_("Setting action %s for product %s on client(s): %s") % (actionRequest, productId, ", ".join(clientIds)))
 			self.service_client.jsonrpc("productOnClient_updateObjects", [productOnClients])
@@ -843,17 +1119,17 @@ class OpsiPackageManager:
 				return
 
 			productPropertyStates = []
-			clientIds = []
+			clientIdSet = set()
 			for productPropertyState in self.service_client.jsonrpc(
 				"productPropertyState_getObjects",
 				[[], {"productId": productId, "objectId": depotClientIds}],
 			):
 				productPropertyStates.append(productPropertyState)
-				if productPropertyState.objectId not in clientIds:
-					clientIds.append(productPropertyState.objectId)
+				clientIdSet.add(productPropertyState.objectId)
 
-			logger.notice("Purging product property states for product '%s' on client(s): %s", productId, ", ".join(clientIds))
-			subject.setMessage(_("Purging product property states for product '%s' on client(s): %s") % (productId, ", ".join(clientIds)))
+			clientIds = ", ".join(sorted(clientIdSet))
+			logger.notice("Purging product property states for product '%s' on client(s): %s", productId, clientIds)
+			subject.setMessage(_("Purging product property states for product '%s' on client(s): %s") % (productId, clientIds))
 
 			self.service_client.jsonrpc("productPropertyState_deleteObjects", [productPropertyStates])
 		except Exception as err:
@@ -862,8 +1138,7 @@ class OpsiPackageManager:
 			raise
 
 	def uploadToRepositories(self) -> None:
-		for packageFile in self.config["packageFiles"]:
-			self.openProductPackageFile(Path(packageFile))
+		self.openProductPackageFiles(self.config["packageFiles"])
 
 		for depotId in self.config["depotIds"]:
 			tq = TaskQueue(name=f"Upload of package(s) {', '.join(self.config['packageFiles'])} to repository '{depotId}'")
@@ -885,23 +1160,21 @@ class OpsiPackageManager:
 
 	def uploadToRepository(self, packageFile: str, depotId: str) -> None:
 		subject = self.getDepotSubject(depotId)
-		repository = None
+		packageFileName = os.path.basename(packageFile)
 
 		try:
 			# Process upload
 			if self.maxTransfersReached():
-				logger.notice("Waiting for free upload slot for upload of '%s' to depot '%s'", os.path.basename(packageFile), depotId)
-				subject.setMessage(_("Waiting for free upload slot for %s") % os.path.basename(packageFile))
-				while self.maxTransfersReached():
-					time.sleep(0.1 * random.randint(1, 20))
-			self.addRunningTransfer()
+				logger.notice("Waiting for free upload slot for upload of '%s' to depot '%s'", packageFileName, depotId)
+				subject.setMessage(_("Waiting for free upload slot for %s") % packageFileName)
+			self.acquireTransferSlot()
 
-			logger.notice("Processing upload of '%s' to depot '%s'", os.path.basename(packageFile), depotId)
-			subject.setMessage(_("Processing upload of %s") % os.path.basename(packageFile))
+			logger.notice("Processing upload of '%s' to depot '%s'", packageFileName, depotId)
+			subject.setMessage(_("Processing upload of %s") % packageFileName)
 
-			packageSize = os.stat(packageFile)[stat.ST_SIZE]
+			packageSize = os.stat(packageFile).st_size
 			localChecksum = self.getPackageMd5Sum(packageFile)
-			destination = os.path.basename(packageFile)
+			destination = packageFileName
 
 			if "~" in destination:
 				logger.notice("Custom-package detected, try to fix that.")
@@ -909,60 +1182,51 @@ class OpsiPackageManager:
 
 			productId = self.getOpsiPackage(packageFile).product.id
 
-			depot = self.service_client.jsonrpc("host_getObjects", [[], {"type": "OpsiDepotserver", "id": depotId}])[0]
+			depot = self.getDepot(depotId)
 			if not depot.repositoryLocalUrl.startswith("file://"):
 				raise ValueError(f"Repository local url '{depot.repositoryLocalUrl}' not supported")
 			depotRepositoryPath = depot.repositoryLocalUrl[7:]
 			if depotRepositoryPath.endswith("/"):
 				depotRepositoryPath = depotRepositoryPath[:-1]
 			logger.info("Depot repository path is '%s'", depotRepositoryPath)
-			logger.info("Using '%s' as repository url", depot.repositoryRemoteUrl)
-
-			maxBandwidth = max(depot.maxBandwidth or 0, 0)
-			if not maxBandwidth and self.config["maxBandwidth"]:
-				maxBandwidth = self.config["maxBandwidth"]
-			if maxBandwidth:
-				logger.info("Setting max bandwidth for depot '%s' to %d kBytes/s", depotId, maxBandwidth)
-
-			repository = getRepository(
-				url=depot.repositoryRemoteUrl,
-				username=depotId,
-				password=depot.opsiHostKey,
-				maxBandwidth=maxBandwidth * 1000,
-				application=USER_AGENT,
-				readTimeout=24 * 3600,  # Upload can take a long time
-			)
-
-			for dest in repository.content():
-				if dest["name"] == destination:
-					logger.info("Destination '%s' already exists on depot '%s'", destination, depotId)
-					if not self.config["overwriteAlways"]:
-						# Not overwriting always => checking file sizes first
-						if repository.fileInfo(destination)["size"] != packageSize:
-							# Size differs => overwrite
-							logger.info("Size of source and destination differs on depot '%s'", depotId)
-						else:
-							# Sizes match => check md5sum
-							logger.info("Size of source and destination matches on depot '%s'", depotId)
-							depotConnection = self.getDepotConnection(depotId)
-							remoteChecksum = depotConnection.depot_getMD5Sum(depotRepositoryPath + "/" + destination)  # type: ignore[attr-defined]
-							if localChecksum == remoteChecksum:
-								# md5sum match => do not overwrite
-								logger.info("MD5sum of source and destination matches on depot '%s'", depotId)
-								logger.notice("No need to upload, '%s' is up to date on '%s'", os.path.basename(packageFile), depotId)
-								subject.setMessage(_("No need to upload, %s is up to date") % os.path.basename(packageFile), severity=4)
-								self.removeRunningTransfer()
-								return
-
-							# md5sums differ => overwrite
-							logger.info("MD5sum of source and destination differs on depot '%s'", depotId)
-
-					logger.info("Overwriting destination '%s' on depot '%s'", destination, depotId)
-					subject.setMessage(_("Overwriting destination %s") % destination)
-					break
+			repository = self.getDepotRepository(depotId, depot)
 
+			# Repository content and disk space usage are independent, fetch them concurrently
 			depotConnection = self.getDepotConnection(depotId)
-			info = depotConnection.depot_getDiskSpaceUsage(depotRepositoryPath)  # type: ignore[attr-defined]
+			with ThreadPoolExecutor(max_workers=2) as executor:
+				diskSpaceUsageFuture = executor.submit(depotConnection.depot_getDiskSpaceUsage, depotRepositoryPath)  # type: ignore[attr-defined]
+				productFiles = self.getRepositoryIndex(depotId, repository).get(productId, {})
+				info = diskSpaceUsageFuture.result()
+
+			existingDestination = productFiles.get(destination)
+			if existingDestination is not None:
+				logger.info("Destination '%s' already exists on depot '%s'", destination, depotId)
+				if not self.config["overwriteAlways"]:
+					# Not overwriting always => checking file sizes first
+					destinationSize = existingDestination.get("size")
+					if destinationSize is None:
+						destinationSize = repository.fileInfo(destination)["size"]
+					if destinationSize != packageSize:
+						# Size differs => overwrite
+						logger.info("Size of source and destination differs on depot '%s'", depotId)
+					else:
+						# Sizes match => check md5sum
+						logger.info("Size of source and destination matches on depot '%s'", depotId)
+						remoteChecksum = depotConnection.depot_getMD5Sum(depotRepositoryPath + "/" + destination)  # type: ignore[attr-defined]
+						if localChecksum == remoteChecksum:
+							# md5sum match => do not overwrite
+							logger.info("MD5sum of source and destination matches on depot '%s'", depotId)
+							logger.notice("No need to upload, '%s' is up to date on '%s'", packageFileName, depotId)
+							subject.setMessage(_("No need to upload, %s is up to date") % packageFileName, severity=4)
+							self.removeRunningTransfer()
+							return
+
+						# md5sums differ => overwrite
+						logger.info("MD5sum of source and destination differs on depot '%s'", depotId)
+
+				logger.info("Overwriting destination '%s' on depot '%s'", destination, depotId)
+				subject.setMessage(_("Overwriting destination %s") % destination)
+
 			if info["available"] < packageSize:
 				subject.setMessage(
 					_("Not enough disk space: %dMB needed, %dMB available")
@@ -974,31 +1238,29 @@ class OpsiPackageManager:
 					f"{(packageSize / (1024 * 1024))}MB needed, {(info['available'] / (1024 * 1024))}MB available"
 				)
 
-			oldPackages = []
-			for dest in repository.content():
-				fileInfo = parseFilename(dest["name"])
-				if not fileInfo:
-					continue
-
-				if fileInfo.productId == productId and dest["name"] != destination:
-					# same product, other version
-					oldPackages.append(dest["name"])
+			# same product, other version
+			oldPackages = [name for name in productFiles if name != destination]
 
 			subject.setMessage(_("Starting upload"))
+			self.invalidateRepositoryIndex(depotId)
 			try:
-				# Do not use delta upload for local depot, because full upload is faster
-				if self.config["deltaUpload"] and oldPackages and depotId != self.config["localDepotId"]:
-					deltaFile = None
+				# Do not use delta upload for local depot and small packages, because full upload is faster
+				deltaUploaded = False
+				if (
+					self.config["deltaUpload"]
+					and oldPackages
+					and depotId != self.config["localDepotId"]
+					and packageSize >= self.config["deltaMinSize"] * 1024
+				):
+					deltaKey = None
 					try:
 						oldPackage = oldPackages[0]
-						depotConnection = self.getDepotConnection(depotId)
 
 						logger.notice("Getting librsync signature of '%s' on depot '%s'", oldPackage, depotId)
 						subject.setMessage(_("Getting librsync signature of %s") % oldPackage)
 
 						sig = depotConnection.depot_librsyncSignature(depotRepositoryPath + "/" + oldPackage)  # type: ignore[attr-defined]
-						if not isinstance(sig, bytes):
-							sig = sig.encode("ascii")
+						# b64decode accepts the ASCII str and bytes returned by the service as is
 						sig = base64.b64decode(sig)
 
 						logger.notice("Calculating delta for depot '%s'", depotId)
@@ -1006,57 +1268,55 @@ class OpsiPackageManager:
 
 						deltaFilename = f"{productId}_{depotId}.delta"
 
-						if deltaFilename in oldPackages:
-							newDeltaFilename = deltaFilename
-							i = 0
-							while newDeltaFilename in oldPackages:
-								newDeltaFilename = deltaFilename + "." + str(i)
-								i += 1
-							deltaFilename = newDeltaFilename
-
-						deltaFile = os.path.join("/tmp", deltaFilename)
+						if deltaFilename in productFiles:
+							deltaFilename = next(
+								f"{deltaFilename}.{i}" for i in itertools.count() if f"{deltaFilename}.{i}" not in productFiles
+							)
 
-						librsyncDeltaFile(packageFile, sig, deltaFile)
+						deltaKey = (packageFile, hashlib.md5(sig).digest())
+						deltaFile = self.acquireDeltaFile(deltaKey, packageFile, sig)
 
-						packageSize = os.stat(packageFile)[stat.ST_SIZE]
-						deltaSize = os.stat(deltaFile)[stat.ST_SIZE]
+						deltaSize = os.stat(deltaFile).st_size
 						speedup = max((float(packageSize) / float(deltaSize)) - 1, 0)
 						logger.notice("Delta calculated, upload speedup is %.3f", speedup)
-						logger.notice("Starting delta upload of '%s' to depot '%s'", deltaFilename, depotId)
-						subject.setMessage(_("Starting delta upload of %s") % os.path.basename(packageFile))
-
-						progressSubject = ProgressSubject(id=depotId, type="upload")
-						progressSubject.setMessage(
-							f"Uploading {os.path.basename(packageFile)} (delta upload, speedup {(speedup * 100):.1f}%)"
-						)
-						if self.userInterface:
-							self.userInterface.addSubject(progressSubject)
+						if deltaSize >= packageSize * DELTA_MAX_SIZE_RATIO:
+							logger.notice("Delta is not considerably smaller than the package, falling back to full upload")
+						else:
+							logger.notice("Starting delta upload of '%s' to depot '%s'", deltaFilename, depotId)
+							subject.setMessage(_("Starting delta upload of %s") % packageFileName)
 
-						try:
-							repository.upload(deltaFile, deltaFilename, progressSubject)
-						finally:
+							progressSubject = ProgressSubject(id=depotId, type="upload")
+							progressSubject.setMessage(f"Uploading {packageFileName} (delta upload, speedup {(speedup * 100):.1f}%)")
 							if self.userInterface:
-								self.userInterface.removeSubject(progressSubject)
+								self.userInterface.addSubject(progressSubject)
 
-						logger.notice("Patching '%s'", oldPackage)
-						subject.setMessage(_("Patching %s") % oldPackage)
+							try:
+								repository.upload(deltaFile, deltaFilename, progressSubject)
+							finally:
+								if self.userInterface:
+									self.userInterface.removeSubject(progressSubject)
 
-						depotConnection.depot_librsyncPatchFile(  # type: ignore[attr-defined]
-							f"{depotRepositoryPath}/{oldPackage}",
-							f"{depotRepositoryPath}/{deltaFilename}",
-							f"{depotRepositoryPath}/{destination}",
-						)
+							logger.notice("Patching '%s'", oldPackage)
+							subject.setMessage(_("Patching %s") % oldPackage)
+
+							depotConnection.depot_librsyncPatchFile(  # type: ignore[attr-defined]
+								f"{depotRepositoryPath}/{oldPackage}",
+								f"{depotRepositoryPath}/{deltaFilename}",
+								f"{depotRepositoryPath}/{destination}",
+							)
 
-						repository.delete(deltaFilename)
+							repository.delete(deltaFilename)
+							deltaUploaded = True
 					finally:
-						if deltaFile and os.path.exists(deltaFile):
-							os.unlink(deltaFile)
-				else:
-					logger.notice("Starting upload of '%s' to depot '%s'", os.path.basename(packageFile), depotId)
-					subject.setMessage(_("Starting upload of %s") % os.path.basename(packageFile))
+						if deltaKey:
+							self.releaseDeltaFile(deltaKey)
+
+				if not deltaUploaded:
+					logger.notice("Starting upload of '%s' to depot '%s'", packageFileName, depotId)
+					subject.setMessage(_("Starting upload of %s") % packageFileName)
 
 					progressSubject = ProgressSubject(id=depotId, type="upload")
-					progressSubject.setMessage(f"Uploading {os.path.basename(packageFile)}")
+					progressSubject.setMessage(f"Uploading {packageFileName}")
 					if self.userInterface:
 						self.userInterface.addSubject(progressSubject)
 					try:
@@ -1065,13 +1325,10 @@ class OpsiPackageManager:
 						if self.userInterface:
 							self.userInterface.removeSubject(progressSubject)
 
-				logger.notice("Upload of '%s' to depot '%s' finished", os.path.basename(packageFile), depotId)
-				subject.setMessage(_("Upload of %s finished") % os.path.basename(packageFile))
+				logger.notice("Upload of '%s' to depot '%s' finished", packageFileName, depotId)
+				subject.setMessage(_("Upload of %s finished") % packageFileName)
 
 				for oldPackage in oldPackages:
-					if oldPackage == destination:
-						continue
-
 					try:
 						logger.notice("Deleting '%s' from depot '%s'", oldPackage, depotId)
 						repository.delete(oldPackage)
@@ -1082,7 +1339,6 @@ class OpsiPackageManager:
 				subject.setMessage(_("Verifying upload"))
 
 				remotePackageFile = f"{depotRepositoryPath}/{destination}"
-				depotConnection = self.getDepotConnection(depotId)
 				remoteChecksum = depotConnection.depot_getMD5Sum(remotePackageFile)  # type: ignore[attr-defined]
 				info = depotConnection.depot_getDiskSpaceUsage(depotRepositoryPath)  # type: ignore[attr-defined]
 				if localChecksum != remoteChecksum:
@@ -1094,18 +1350,29 @@ class OpsiPackageManager:
 					logger.warning("Warning: %d%% filesystem usage at repository on depot '%s'", int(100 * info["usage"]), depotId)
 					subject.setMessage(_("Warning: %d%% filesystem usage") % int(100 * info["usage"]), severity=3)
 
-				logger.notice("Upload of '%s' to depot '%s' successful", os.path.basename(packageFile), depotId)
-				subject.setMessage(_("Upload of %s successful") % os.path.basename(packageFile), severity=4)
+				logger.notice("Upload of '%s' to depot '%s' successful", packageFileName, depotId)
+				subject.setMessage(_("Upload of %s successful") % packageFileName, severity=4)
 
+				# Both files are created from the uploaded package, let the depot create them concurrently
 				remotePackageMd5sumFile = remotePackageFile + ".md5"
+				remotePackageZsyncFile = remotePackageFile + ".zsync"
+				with ThreadPoolExecutor(max_workers=2) as executor:
+					md5sumFileFuture = executor.submit(
+						depotConnection.depot_createMd5SumFile,  # type: ignore[attr-defined]
+						remotePackageFile,
+						remotePackageMd5sumFile,
+					)
+					zsyncFileFuture = executor.submit(
+						depotConnection.depot_createZsyncFile,  # type: ignore[attr-defined]
+						remotePackageFile,
+						remotePackageZsyncFile,
+					)
 				try:
-					depotConnection.depot_createMd5SumFile(remotePackageFile, remotePackageMd5sumFile)  # type: ignore[attr-defined]
+					md5sumFileFuture.result()
 				except Exception as err:
 					logger.warning("Failed to create md5sum file '%s': %s", remotePackageMd5sumFile, err)
-
-				remotePackageZsyncFile = remotePackageFile + ".zsync"
 				try:
-					depotConnection.depot_createZsyncFile(remotePackageFile, remotePackageZsyncFile)  # type: ignore[attr-defined]
+					zsyncFileFuture.result()
 				except Exception as err:
 					logger.warning("Failed to create zsync file '%s': %s", remotePackageZsyncFile, err)
 			finally:
@@ -1115,41 +1382,15 @@ class OpsiPackageManager:
 			logger.error(uploadError)
 			subject.setMessage(_("Error: %s") % uploadError, severity=2)
 			raise
-		finally:
-			if repository:
-				logger.debug("Closing repository connection")
-				try:
-					repository.disconnect()
-				except Exception as upload_error:
-					logger.error("Failed to disconnect from repository: %s", upload_error, exc_info=True)
 
 	def installOnDepots(self) -> None:
-		sequence = [self.getOpsiPackage(packageFile).product.id for packageFile in self.config["packageFiles"]]
-
-		for packageFile in self.config["packageFiles"]:
-			productId = self.getOpsiPackage(packageFile).product.id
-			for dependency in self.getOpsiPackage(packageFile).package_dependencies:
-				try:
-					ppos = sequence.index(productId)
-					dpos = sequence.index(dependency.package)
-					if ppos < dpos:
-						sequence.remove(dependency.package)
-						sequence.insert(ppos, dependency.package)
-				except Exception as err:
-					logger.debug("While processing package '%s', dependency '%s': %s", packageFile, dependency.package, err)
-
-		sortedPackageFiles = []
-		for productId in sequence:
-			for packageFile in self.config["packageFiles"]:
-				if productId == self.getOpsiPackage(packageFile).product.id:
-					sortedPackageFiles.append(packageFile)
-					break
-
-		self.config["packageFiles"] = sortedPackageFiles
+		self.openProductPackageFiles(self.config["packageFiles"])
+		opsiPackages = {packageFile: self.getOpsiPackage(packageFile) for packageFile in self.config["packageFiles"]}
+		self.config["packageFiles"] = sort_package_files_by_dependencies(opsiPackages)
 
 		if not self.config["forceInstall"]:
 			logger.info("Checking product locks")
-			productIds = [self.getOpsiPackage(packageFile).product.id for packageFile in self.config["packageFiles"]]
+			productIds = [opsiPackages[packageFile].product.id for packageFile in self.config["packageFiles"]]
 			lockedProductsOnDepot = self.service_client.jsonrpc(
 				"productOnDepot_getObjects", [[], {"productId": productIds, "depotId": self.config["depotIds"], "locked": True}]
 			)
@@ -1163,24 +1404,21 @@ class OpsiPackageManager:
 				raise RuntimeError(f"{nwl}{nwl.join(errors)}{nwl}Use --force to force installation")
 
 		if self.userInterface and (self.config["properties"] == "ask"):
-			productProperties: list[ProductProperty] = []
-			products = {}
+			productProperties: list[tuple[ProductProperty, Product]] = []
 			for packageFile in self.config["packageFiles"]:
-				product = self.getOpsiPackage(packageFile).product
-				for productProperty in self.getOpsiPackage(packageFile).product_properties:
-					productProperties.append(productProperty)
-					products[productProperty.getIdent(returnType="unicode")] = product
+				product = opsiPackages[packageFile].product
+				for productProperty in opsiPackages[packageFile].product_properties:
+					productProperties.append((productProperty, product))
 
 			if productProperties:
 				self.userInterface.exit()
 				ui = SnackUI()
 
 				i = 0
-				productProperties = sorted(productProperties, key=lambda pp: pp.propertyId)
+				productProperties.sort(key=lambda pp: pp[0].propertyId)
 
 				while i < len(productProperties):
-					productProperty = productProperties[i]
-					product = products[productProperty.getIdent(returnType="unicode")]
+					productProperty, product = productProperties[i]
 
 					logger.notice("Getting product property defaults from user")
 					title = _("Please select product property defaults")
@@ -1216,7 +1454,7 @@ class OpsiPackageManager:
 						if _("<other value>") in selection:
 							addNewValue = True
 
-						productProperties[i].setDefaultValues(selection)
+						productProperty.setDefaultValues(selection)
 					else:
 						addNewValue = True
 
@@ -1233,16 +1471,16 @@ class OpsiPackageManager:
 							i = max(i, 0)
 							continue
 
-						possibleValues = productProperties[i].getPossibleValues() or []
+						possibleValues = productProperty.getPossibleValues() or []
 						if value not in possibleValues:
 							possibleValues.append(value)
-							productProperties[i].setPossibleValues(possibleValues)
-						productProperties[i].setDefaultValues(value)
+							productProperty.setPossibleValues(possibleValues)
+						productProperty.setDefaultValues(value)
 					logger.notice(
 						"Product '%s', property '%s': default values set to: %s",
-						productProperties[i].productId,
-						productProperties[i].propertyId,
-						productProperties[i].defaultValues,
+						productProperty.productId,
+						productProperty.propertyId,
+						productProperty.defaultValues,
 					)
 					i += 1
 				ui.exit()
@@ -1279,7 +1517,7 @@ class OpsiPackageManager:
 		depotPackageFile = packageFile
 
 		try:
-			depot = self.service_client.jsonrpc("host_getObjects", [[], {"type": "OpsiDepotserver", "id": depotId}])[0]
+			depot = self.getDepot(depotId)
 			if self.config["uploadToLocalDepot"] or (depotId != self.config["localDepotId"]):
 				if not depot.repositoryLocalUrl.startswith("file://"):
 					raise ValueError(f"Repository local url '{depot.repositoryLocalUrl}' not supported")
@@ -1429,22 +1667,24 @@ class OpsiPackageManager:
 		self.service_client.product_deleteObjects(purge_products)  # type: ignore[attr-defined]
 
 	def uninstallPackages(self, ignore_not_installed: bool = False) -> None:
+		installedProductIds = defaultdict(list)
+		for productOnDepot in self.service_client.jsonrpc(
+			"productOnDepot_getObjects",
+			[[], {"depotId": self.config["depotIds"], "productId": self.config["productIds"]}],
+		):
+			installedProductIds[productOnDepot.depotId].append(productOnDepot.productId)
+
+		packageNotInstalled = False
 		for depotId in self.config["depotIds"]:
 			subject = self.getDepotSubject(depotId)
-			packageNotInstalled = False
-			productIds = []
+			productIds = installedProductIds[depotId]
 			for product in self.config["productIds"]:
-				package = self.service_client.jsonrpc("productOnDepot_getObjects", [[], {"depotId": depotId, "productId": str(product)}])
-				if not package:
+				# Product ids may contain wildcards
+				if not filter_product_ids(productIds, str(product)):
 					subject.setMessage(_(f"WARNING: Product {product} not installed on depot {depotId}."), severity=3)
 					logger.warning("WARNING: Product %s not installed on depot %s.", product, depotId)
 					packageNotInstalled = True
 
-			for productOnDepot in self.service_client.jsonrpc(
-				"productOnDepot_getObjects",
-				[[], {"depotId": depotId, "productId": self.config["productIds"]}],
-			):
-				productIds.append(productOnDepot.productId)
 			if not productIds:
 				continue
 			tq = TaskQueue(name=f"Uninstall of package(s) {', '.join(productIds)} on depot '{depotId}'")
@@ -1474,17 +1714,12 @@ class OpsiPackageManager:
 			logger.notice("Uninstalling package '%s' on depot '%s'", productId, depotId)
 			subject.setMessage(_(f"Uninstalling package {productId}"))
 
-			depot = self.service_client.jsonrpc("host_getObjects", [[], {"type": "OpsiDepotserver", "id": depotId}])[0]
-			logger.info("Using '%s' as repository url", depot.repositoryRemoteUrl)
-			repository = getRepository(url=depot.repositoryRemoteUrl, username=depotId, password=depot.opsiHostKey)
-			for destination in repository.listdir():
-				fileInfo = parseFilename(destination)
-				if not fileInfo:
-					continue
-
-				if not fileInfo.productId == productId:
-					continue
-
+			depot = self.getDepot(depotId)
+			repository = self.getDepotRepository(depotId, depot)
+			destinations = list(self.getRepositoryIndex(depotId, repository).get(productId, {}))
+			if destinations:
+				self.invalidateRepositoryIndex(depotId)
+			for destination in destinations:
 				logger.info("Deleting destination '%s' on depot '%s'", destination, depotId)
 				repository.delete(destination)
 
@@ -1522,17 +1757,18 @@ class OpsiPackageManagerControl:
 		parser.add_argument("-V", "--version", action="store_true", dest="version")
 		parser.add_argument("-v", "--verbose", action="count", dest="verbose")
 		parser.add_argument("-q", "--quiet", action="store_true", dest="quiet")
-		parser.add_argument("-i", "--install", action="store_true", dest="COMMAND_INSTALL")
-		parser.add_argument("-u", "--upload", action="store_true", dest="COMMAND_UPLOAD")
+		commands = parser.add_mutually_exclusive_group()
+		commands.add_argument("-i", "--install", action="store_const", dest="command", const="install")
+		commands.add_argument("-u", "--upload", action="store_const", dest="command", const="upload")
+		commands.add_argument("-l", "--list", action="store_const", dest="command", const="list")
+		commands.add_argument("-D", "--differences", action="store_const", dest="command", const="differences")
+		commands.add_argument("-r", "--remove", action="store_const", dest="command", const="remove")
+		commands.add_argument("--purge", action="store_const", dest="command", const="purge")
+		commands.add_argument("-R", "--repo-remove", action="store_const", dest="command", const="repo_remove")
+		commands.add_argument("-x", "--extract", action="store_const", dest="command", const="extract")
 		parser.add_argument("-p", "--properties", action="store", dest="properties", default="keep", choices=["ask", "package", "keep"])
 		parser.add_argument("--max-transfers", action="store", dest="maxTransfers", default=0, type=int)
 		parser.add_argument("--max-bandwidth", action="store", dest="maxBandwidth", default=0, type=int)
-		parser.add_argument("-l", "--list", action="store_true", dest="COMMAND_LIST")
-		parser.add_argument("-D", "--differences", action="store_true", dest="COMMAND_DIFFERENCES")
-		parser.add_argument("-r", "--remove", action="store_true", dest="COMMAND_REMOVE")
-		parser.add_argument("--purge", action="store_true", dest="COMMAND_PURGE")
-		parser.add_argument("-R", "--repo-remove", action="store_true", dest="COMMAND_REPOREMOVE")
-		parser.add_argument("-x", "--extract", action="store_true", dest="COMMAND_EXTRACT")
 		parser.add_argument("--new-product-id", action="store", dest="newProductId")
 		parser.add_argument("-d", "--depots", action="store", dest="depots")
 		parser.add_argument("-f", "--force", action="store_true", dest="force")
@@ -1540,6 +1776,7 @@ class OpsiPackageManagerControl:
 		parser.add_argument("-t", "--temp-dir", action="store", dest="tempDir")
 		parser.add_argument("-o", "--overwrite", action="store_true", dest="overwriteAlways")
 		parser.add_argument("-n", "--no-delta", action="store_true", dest="noDelta")
+		parser.add_argument("--delta-min-size", action="store", dest="deltaMinSize", default=None, type=int)
 		parser.add_argument("-S", "--setup", action="store_true", dest="setupWhereInstalled")
 		parser.add_argument("-s", "--setup-with-dependencies", action="store_true", dest="setupWhereInstalledWithDependencies")
 		parser.add_argument("-U", "--update", action="store_true", dest="updateWhereInstalled")
@@ -1565,14 +1802,7 @@ class OpsiPackageManagerControl:
 			print(f"{__version__} [python-opsi={python_opsi_version}]")
 			sys.exit(0)
 
-		need_opsi_server = (
-			self.opts.COMMAND_INSTALL
-			or self.opts.COMMAND_UPLOAD
-			or self.opts.COMMAND_REMOVE
-			or self.opts.COMMAND_PURGE
-			or self.opts.COMMAND_LIST
-			or self.opts.COMMAND_DIFFERENCES
-		)
+		need_opsi_server = self.opts.command in ("install", "upload", "remove", "purge", "list", "differences")
 
 		self.setDefaultConfig(opsi_server=need_opsi_server)
 		self.setCommandlineConfig()
@@ -1599,19 +1829,17 @@ class OpsiPackageManagerControl:
 
 				knownDepotIds = set(self.service_client.jsonrpc("host_getIdents", ["unicode", {"type": "OpsiDepotserver"}]))
 
-				if any(depotId.lower() == "all" for depotId in forceStringList(self.config["depotIds"])):
-					self.config["depotIds"] = list(knownDepotIds)
+				depotIds = forceStringList(self.config["depotIds"])
+				if any(depotId.lower() == "all" for depotId in depotIds):
+					cleanedDepotIds = knownDepotIds
 				else:
-					cleanedDepotIds = set()
-					for depotId in forceStringList(self.config["depotIds"]):
-						depotId = forceHostId(depotId)
-						if depotId not in knownDepotIds:
-							raise RuntimeError(f"Depot '{depotId}' not in list of known depots: {','.join(knownDepotIds)}")
-						cleanedDepotIds.add(depotId)
-
-					self.config["depotIds"] = list(cleanedDepotIds)
+					cleanedDepotIds = {forceHostId(depotId) for depotId in depotIds}
+					unknownDepotIds = cleanedDepotIds - knownDepotIds
+					if unknownDepotIds:
+						unknown = "', '".join(sorted(unknownDepotIds))
+						raise RuntimeError(f"Depot '{unknown}' not in list of known depots: {','.join(knownDepotIds)}")
 
-				self.config["depotIds"] = sorted(forceStringList(self.config["depotIds"]))
+				self.config["depotIds"] = sorted(cleanedDepotIds)
 			except Exception:
 				if self.service_client:
 					self.service_client.disconnect()
@@ -1675,32 +1903,36 @@ class OpsiPackageManagerControl:
 			elif command == "extract":
 				self.processExtractCommand()
 		finally:
-			for thread in threading.enumerate():
+			# Only the task queues are our worker threads, one timeout for all of them
+			deadline = time.monotonic() + 5
+			for taskQueue in self._opm.taskQueues if self._opm else []:
 				try:
-					thread.join(5)
+					taskQueue.join(max(deadline - time.monotonic(), 0))
 				except Exception:
 					pass
 
 		if self._opm:
 			errors = self._opm.getTaskQueueErrors()
 			if errors:
-				print(_("Errors occurred: "), file=sys.stderr)
+				errLines = [_("Errors occurred: ") + "\n"]
+				logLines = []
 				for name, errs in errors.items():
-					logger.error("Failure while processing %s:", name)
-					print("   " + (_("Failure while processing %s:") % name), file=sys.stderr)
+					errLines.append("   " + (_("Failure while processing %s:") % name) + "\n")
+					logLines.append(f"Failure while processing {name}:\n")
 					for err in errs:
-						logger.error("      %s", err)
-						print(f"      {err}", file=sys.stderr)
+						errLines.append(f"      {err}\n")
+						logLines.append(f"      {err}\n")
+				logger.error("Errors occurred:\n%s", "".join(logLines).rstrip("\n"))
+				sys.stderr.writelines(errLines)
+				sys.stderr.flush()
 
 				raise TaskError(f"{len(errors)} errors during the processing of tasks.")
 
 	def processExtractCommand(self) -> None:
 		destinationDir = os.path.abspath(os.getcwd())
-		temp_dir = None
-		if self.config.get("tempDir"):
-			temp_dir = Path(str(self.config["tempDir"]))
-		for packageFile in forceStringList(self.config["packageFiles"]):
-			opsi_package = OpsiPackage(Path(packageFile), temp_dir=temp_dir)
+		packageFiles = forceStringList(self.config["packageFiles"])
+		for packageFile in packageFiles:
+			opsi_package = get_opsi_package(Path(packageFile), self.config.get("tempDir"))  # type: ignore[arg-type]
 
 			productId = opsi_package.product.id
 			if not productId:
@@ -1710,15 +1942,19 @@ class OpsiPackageManagerControl:
 				productId = forceProductId(self.config["newProductId"])
 				newProductId = productId
 			packageDestinationDir = os.path.join(destinationDir, productId)
-			if os.path.exists(packageDestinationDir):
-				raise OSError(f"Destination directory '{packageDestinationDir}' already exists")
-			os.mkdir(packageDestinationDir)
+			try:
+				os.mkdir(packageDestinationDir)
+			except FileExistsError as err:
+				raise OSError(f"Destination directory '{packageDestinationDir}' already exists") from err
 
 			opsi_package.extract_package_archive(
 				Path(packageFile), destination=Path(packageDestinationDir), new_product_id=newProductId, custom_separated=True
 			)
 
 	def processListCommand(self) -> None:
+		if self.config["quiet"]:
+			return
+
 		assert self.service_client
 		terminalWidth = 60
 		try:
@@ -1729,23 +1965,19 @@ class OpsiPackageManagerControl:
 		except Exception:
 			pass
 
+		depotIds = forceStringList(self.config["depotIds"])
 		indent = "   "
 		idWidth = versionWidth = int((terminalWidth - len(indent)) / 3)
 		idWidth = min(idWidth, 25)
 		versionWidth = min(versionWidth, 25)
 		productOnDepots = self.service_client.jsonrpc(
 			"productOnDepot_getObjects",
-			[[], {"depotId": self.config["depotIds"], "productId": self.config["productIds"]}],
+			[[], {"depotId": depotIds, "productId": self.config["productIds"]}],
 		)
 		products = self.service_client.jsonrpc("product_getObjects", [[], {"id": self.config["productIds"]}])
 
-		productInfo: dict[str, dict[str, dict[str, Product]]] = {}
+		productInfo: dict[str, dict[str, dict[str, Product]]] = defaultdict(lambda: defaultdict(dict))
 		for product in products:
-			if product.id not in productInfo:
-				productInfo[product.id] = {}
-			if product.productVersion not in productInfo[product.id]:
-				productInfo[product.id][product.productVersion] = {}
-
 			productInfo[product.id][product.productVersion][product.packageVersion] = product
 
 			if len(product.id) > idWidth:
@@ -1753,51 +1985,22 @@ class OpsiPackageManagerControl:
 
 		nameWidth = terminalWidth - len(indent) - idWidth - versionWidth - 4
 
-		productOnDepotInfo: dict[str, dict[str, ProductOnDepot]] = {}
-		for depotId in forceStringList(self.config["depotIds"]):
-			productOnDepotInfo[depotId] = {}
+		productOnDepotInfo: dict[str, dict[str, ProductOnDepot]] = {depotId: {} for depotId in depotIds}
 		for productOnDepot in productOnDepots:
 			productOnDepotInfo[productOnDepot.depotId][productOnDepot.productId] = productOnDepot
 
-		if self.config["quiet"]:
-			return
-
+		header = f"{indent}{'Product ID'.ljust(idWidth)} {'Version'.ljust(versionWidth)} {'Name'.ljust(nameWidth)}"
+		separator = f"{indent}{'=' * (terminalWidth - len(indent) - 2)}"
 		for depotId, values in productOnDepotInfo.items():
-			print("-" * (len(depotId) + 4))
-			print(f"- {depotId} -")
-			print("-" * (len(depotId) + 4))
-			print(
-				"%s%*s %*s %*s"
-				% (
-					indent,
-					-1 * idWidth,
-					"Product ID",
-					-1 * versionWidth,
-					"Version",
-					-1 * nameWidth,
-					"Name",
-				)
-			)
-			print(f"{indent}{'=' * (terminalWidth - len(indent) - 2)}")
-			productIds = list(values.keys())
-			productIds.sort()
-
-			for productId in productIds:
+			lines = ["-" * (len(depotId) + 4), f"- {depotId} -", "-" * (len(depotId) + 4), header, separator]
+			for productId in sorted(values):
 				productOnDepot = values[productId]
 				product = productInfo[productOnDepot.productId][productOnDepot.productVersion][productOnDepot.packageVersion]
-				print(
-					"%s%*s %*s %*s"
-					% (
-						indent,
-						-1 * idWidth,
-						productId,
-						-1 * versionWidth,
-						product.version,
-						-1 * nameWidth,
-						product.name.replace("\n", "")[:nameWidth],
-					)
-				)
-			print("")
+				name = product.name.translate(CONTROL_CHARS_TABLE)[:nameWidth]
+				lines.append(f"{indent}{productId.ljust(idWidth)} {product.version.ljust(versionWidth)} {name.ljust(nameWidth)}")
+			lines.append("\n")
+			# One write per depot instead of one print per product
+			sys.stdout.write("\n".join(lines))
 
 	def processDifferencesCommand(self) -> None:
 		if self.config["quiet"]:
@@ -1816,41 +2019,33 @@ class OpsiPackageManagerControl:
 			productOnDepotInfo[productOnDepot.depotId][productOnDepot.productId] = productOnDepot
 
 		maxWidth = max(len(depotId) for depotId in depotIds)
+		# The padded depot labels are the same for every product
+		depotLabels = {depotId: f"    {depotId:<{maxWidth}}: " for depotId in depotIds}
+
+		differingProductIds = []
+		for productId in productIds:
+			versions = set()
+			for depotId in depotIds:
+				productOnDepot = productOnDepotInfo[depotId].get(productId)
+				versions.add((productOnDepot.productVersion, productOnDepot.packageVersion) if productOnDepot else None)
+			if len(versions) > 1:
+				differingProductIds.append(productId)
+		# Only sort the products which will be printed
+		differingProductIds.sort()
 
-		depotsInSync = True
 		notInstalledText = _("not installed")
-		for productId in sorted(productIds):
-			differs = False
+		for productId in differingProductIds:
 			lines = [productId]
-			productVersion = None
-			packageVersion = None
 			for depotId in depotIds:
-				try:
-					productOnDepot = productOnDepotInfo[depotId][productId]
-				except KeyError:
-					lines.append(f"    {depotId:<{maxWidth}}: {notInstalledText}")
-					differs = True
-					continue
-
-				if not productVersion:
-					productVersion = productOnDepot.productVersion
-				elif productVersion != productOnDepot.productVersion:
-					differs = True
-
-				if not packageVersion:
-					packageVersion = productOnDepot.packageVersion
-				elif packageVersion != productOnDepot.packageVersion:
-					differs = True
-
-				lines.append(f"    {depotId:<{maxWidth}}: {productOnDepot.productVersion}-{productOnDepot.packageVersion}")
-
-			if differs:
-				depotsInSync = False
-				for line in lines:
-					print(line)
-				print("")
-
-		if depotsInSync:
+				productOnDepot = productOnDepotInfo[depotId].get(productId)
+				if productOnDepot:
+					lines.append(f"{depotLabels[depotId]}{productOnDepot.productVersion}-{productOnDepot.packageVersion}")
+				else:
+					lines.append(depotLabels[depotId] + notInstalledText)
+			print("\n".join(lines))
+			print("")
+
+		if not differingProductIds:
 			syncMessage = _("There are no differences between the depots")
 			print(syncMessage)
 
@@ -1888,7 +2083,8 @@ class OpsiPackageManagerControl:
 
 	def processRepoRemoveCommand(self) -> None:
 		BASE_PATH = "/var/lib/opsi/repository"
-		for product in forceStringList(self.config["productIds"]):
+		productIds = forceStringList(self.config["productIds"])
+		for product in productIds:
 			path = os.path.join(BASE_PATH, f"{product}_*")
 			matches = glob.glob(path)
 			if not matches:
@@ -1911,6 +2107,7 @@ class OpsiPackageManagerControl:
 			"maxTransfers": 20,
 			"maxBandwidth": 0,  # Kbyte/s
 			"deltaUpload": False,
+			"deltaMinSize": 32768,  # Kbyte
 			"newProductId": None,
 			"depotIds": [],
 			"uploadToLocalDepot": False,
@@ -1940,75 +2137,42 @@ class OpsiPackageManagerControl:
 			self.config["consoleLogLevel"] = 3 + self.opts.verbose
 			if self.opts.properties != "ask":
 				self.config["quiet"] = True
-		if self.opts.logFile:
-			self.config["logFile"] = self.opts.logFile
-		if self.opts.fileLogLevel:
-			self.config["fileLogLevel"] = forceInt(self.opts.fileLogLevel)
-		if self.opts.tempDir:
-			self.config["tempDir"] = str(self.opts.tempDir)
-		if self.opts.depots:
-			self.config["depotIds"] = self.opts.depots.split(",")
-		if self.opts.newProductId:
-			self.config["newProductId"] = forceProductId(self.opts.newProductId)
-		if self.opts.maxBandwidth:
-			self.config["maxBandwidth"] = self.opts.maxBandwidth
-		if self.opts.maxTransfers:
-			self.config["maxTransfers"] = self.opts.maxTransfers
-		if self.opts.overwriteAlways:
-			self.config["overwriteAlways"] = True
-		if self.opts.noDelta:
-			self.config["deltaUpload"] = False
-		if self.opts.keepFiles:
-			self.config["deleteFilesOnUninstall"] = False
-		if self.opts.properties:
-			self.config["properties"] = self.opts.properties
 		if self.opts.force:
 			self.config["forceInstall"] = self.config["forceUninstall"] = True
-		if self.opts.setupWhereInstalled:
-			self.config["setupWhereInstalled"] = True
-		if self.opts.setupWhereInstalledWithDependencies:
-			self.config["setupWhereInstalledWithDependencies"] = True
-		if self.opts.updateWhereInstalled:
-			self.config["updateWhereInstalled"] = True
-		if self.opts.purgeClientProperties:
-			self.config["purgeClientProperties"] = True
-		if self.opts.suppressPackageContentFileGeneration:
-			self.config["suppressPackageContentFileGeneration"] = True
-
-		# Get command
-		if self.opts.COMMAND_INSTALL:
-			if self.config["command"]:
-				raise ValueError("More than one command specified")
-			self.config["command"] = "install"
-		if self.opts.COMMAND_UPLOAD:
-			if self.config["command"]:
-				raise ValueError("More than one command specified")
-			self.config["command"] = "upload"
-		if self.opts.COMMAND_LIST:
-			if self.config["command"]:
-				raise ValueError("More than one command specified")
-			self.config["command"] = "list"
-		if self.opts.COMMAND_REMOVE:
-			if self.config["command"]:
-				raise ValueError("More than one command specified")
-			self.config["command"] = "remove"
-		if self.opts.COMMAND_PURGE:
-			if self.config["command"]:
-				raise ValueError("More than one command specified")
-			self.config["command"] = "purge"
-		if self.opts.COMMAND_REPOREMOVE:
-			if self.config["command"]:
-				raise ValueError("More than one command specified")
-			self.config["command"] = "repo_remove"
-		if self.opts.COMMAND_EXTRACT:
-			if self.config["command"]:
-				raise ValueError("More than one command specified")
-			self.config["command"] = "extract"
-		if self.opts.COMMAND_DIFFERENCES:
-			if self.config["command"]:
-				raise ValueError("More than one command specified")
-			self.config["command"] = "differences"
-
+		if self.opts.deltaMinSize is not None:
+			self.config["deltaMinSize"] = self.opts.deltaMinSize
+
+		opts = vars(self.opts)
+		# Options copied to the config if given, with an optional conversion
+		for option, key, convert in (
+			("logFile", "logFile", None),
+			("fileLogLevel", "fileLogLevel", forceInt),
+			("tempDir", "tempDir", str),
+			("depots", "depotIds", lambda depots: depots.split(",")),
+			("newProductId", "newProductId", forceProductId),
+			("maxBandwidth", "maxBandwidth", None),
+			("maxTransfers", "maxTransfers", None),
+			("properties", "properties", None),
+		):
+			if opts[option]:
+				self.config[key] = convert(opts[option]) if convert else opts[option]
+
+		# Flags setting a fixed config value
+		for option, key, value in (
+			("overwriteAlways", "overwriteAlways", True),
+			("noDelta", "deltaUpload", False),
+			("keepFiles", "deleteFilesOnUninstall", False),
+			("setupWhereInstalled", "setupWhereInstalled", True),
+			("setupWhereInstalledWithDependencies", "setupWhereInstalledWithDependencies", True),
+			("updateWhereInstalled", "updateWhereInstalled", True),
+			("purgeClientProperties", "purgeClientProperties", True),
+			("suppressPackageContentFileGeneration", "suppressPackageContentFileGeneration", True),
+		):
+			if opts[option]:
+				self.config[key] = value
+
+		# argparse makes sure that only one command is given
+		self.config["command"] = self.opts.command
 		if not self.config["command"]:
 			raise ValueError("No command specified")
 
@@ -2019,8 +2183,12 @@ class OpsiPackageManagerControl:
 			self.config["productIds"] = self.args
 
 	def signalHandler(self, signo: int, stackFrame: FrameType | None) -> None:
-		for thread in threading.enumerate():
-			logger.debug("Running thread before signal: %s", thread)
+		# Only the task queues are of interest, do not walk all threads of the process
+		taskQueues = list(self._opm.taskQueues) if self._opm else []
+		logThreads = logger.isEnabledFor(logging.DEBUG)
+		if logThreads:
+			for thread in taskQueues:
+				logger.debug("Running thread before signal: %s", thread)
 
 		if signo in (SIGTERM, SIGINT):
 			if self._opm:
@@ -2029,59 +2197,14 @@ class OpsiPackageManagerControl:
 		if self.service_client:
 			self.service_client.disconnect()
 
-		for thread in threading.enumerate():
-			logger.debug("Running thread after signal: %s", thread)
+		if logThreads:
+			for thread in taskQueues:
+				if thread.is_alive():
+					logger.debug("Running thread after signal: %s", thread)
 
 	def usage(self) -> None:
-		print(f"\nUsage: {os.path.basename(sys.argv[0])} [options] <command>")
-		print("")
-		print("Manage opsi packages")
-		print("")
-		print("Commands:")
-		print("  -i, --install      <opsi-package> ...      install opsi packages")
-		print("  -u, --upload       <opsi-package> ...      upload opsi packages to repositories")
-		print("  -l, --list         <regex>                 list opsi packages matching regex")
-		print("  -D, --differences  <regex>                 show depot differences of opsi packages matching regex")
-		print("  -r, --remove       <opsi-product-id> ...   uninstall opsi packages")
-		print("      --purge        [opsi-product-id] ...   uninstall opsi packages and purge product data")
-		print("                                             if no products are specified, purge the product data")
-		print("                                             of all products that are not installed")
-		print("  -R, --repo-remove  <opsi-product-id> ...   remove opsi packages from local repository")
-		print("  -x, --extract      <opsi-package> ...      extract opsi packages to local directory")
-		print("  -V, --version                              show program's version info and exit")
-		print("  -h, --help                                 show this help message and exit")
-		print("")
-		print("Options:")
-		print("  -v, --verbose                           increase verbosity (can be used multiple times)")
-		print("  -q, --quiet                             do not display any messages")
-		print("  --log-file         <log-file>           path to debug log file")
-		print("  --log-file-level   <log-file-level>     log file level (default 4)")
-		print("  -d, --depots       <depots>             comma separated list of depot ids to process")
-		print("                                      all = all known depots")
-		print("  -p, --properties   <mode>               mode for default product property values")
-		print("                                  ask     = display dialog")
-		print("                                  package = use defaults from package")
-		print("	                                 keep    = keep depot defaults (default)")
-		print("  --purge-client-properties               remove product property states of the installed product(s)")
-		print("  -f, --force                             force install/uninstall (use with extreme caution)")
-		print('  -U, --update                            set action "update" on hosts where installation status is "installed"')
-		print('  -S, --setup                             set action "setup" on hosts where installation status is "installed"')
-		print(
-			'  -s, --setup-with-dependencies           set action "setup" on hosts where installation status is "installed" with dependencies'
-		)
-		print("  -o, --overwrite                         overwrite existing package on upload even if size matches")
-		print("  -n, --no-delta                          full package transfers on uploads (do not use librsync)")
-		print("  -k, --keep-files                        do not delete client data dir on uninstall")
-		print("  -t, --temp-dir     <path>               tempory directory for package install")
-		print("  --max-transfers    <num>                maximum number of simultaneous uploads")
-		print("                                             0 = unlimited (default = 20)")
-		print("  --max-bandwidth    <kbps>               maximum transfer rate for each transfer (in kilobytes per second)")
-		print("                                             0 = unlimited (default = 0)")
-		print("  --new-product-id   <product-id>         Set a new product id when extracting opsi package or")
-		print("                                          set a specific product ID during installation.")
-		print("  --suppress-pcf-generation               Suppress the generation of a package content file during package")
-		print("                                          installation. Do not use with WAN extension!")
-		print("")
+		sys.stdout.write(USAGE.format(prog=os.path.basename(sys.argv[0])))
+		sys.stdout.flush()
 
 
 def main() -> None:
@@ -2112,7 +2235,75 @@ def main() -> None:
 		sys.exit(1)
 
 
+def sort_package_files_by_dependencies(opsiPackages: dict[str, OpsiPackage]) -> list[str]:
+	"""
+	Sorts the package files so that package dependencies are installed first.
+	Apart from that the given order is kept.
+	"""
+	packageFilesByProductId: dict[str, list[str]] = defaultdict(list)
+	for packageFile, opsiPackage in opsiPackages.items():
+		packageFilesByProductId[opsiPackage.product.id].append(packageFile)
+
+	# Depth-first topological sort, dependencies are added before the package itself
+	sortedPackageFiles: list[str] = []
+	visited: set[str] = set()
+
+	def visit(packageFile: str) -> None:
+		if packageFile in visited:
+			# Already sorted or circular dependency
+			return
+		visited.add(packageFile)
+		for dependency in opsiPackages[packageFile].package_dependencies:
+			for dependencyPackageFile in packageFilesByProductId.get(dependency.package, []):
+				visit(dependencyPackageFile)
+		sortedPackageFiles.append(packageFile)
+
+	for packageFile in opsiPackages:
+		visit(packageFile)
+	return sortedPackageFiles
+
+
+@lru_cache(maxsize=64)
+def _product_id_regex(pattern: str) -> re.Pattern:
+	return re.compile(".*".join(re.escape(part) for part in pattern.lower().split("*")), re.IGNORECASE)
+
+
+def filter_product_ids(productIds: list[str], pattern: str) -> list[str]:
+	"""
+	Returns the product ids matching the pattern like the productId filter of the backend.
+	Only `*` is a wildcard and the case is ignored.
+	"""
+	regex = _product_id_regex(pattern)
+	return [productId for productId in productIds if regex.fullmatch(productId)]
+
+
+def file_md5sum(filename: str) -> str:
+	with open(filename, "rb") as file:
+		os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+		return hashlib.file_digest(file, "md5").hexdigest()
+
+
 def set_product_cache_outdated(depotId: str, service_client: ServiceClient) -> None:
 	logger.debug("mark redis product cache as dirty for depot: %s", depotId)
 	config_id = f"opsiconfd.{depotId}.product.cache.outdated"
 	service_client.jsonrpc("config_createBool", [config_id, "", [True]])
+
+
+@lru_cache(maxsize=4096)
+def _parse_filename(filename: str) -> Any:
+	# The same package files are listed on every depot
+	return parseFilename(filename)
+
+
+@lru_cache(maxsize=64)
+def _parse_package(path: str, mtime_ns: int, temp_dir: str | None) -> OpsiPackage:
+	return OpsiPackage(Path(path), temp_dir=Path(temp_dir) if temp_dir else None)
+
+
+def get_opsi_package(packageFile: Path, temp_dir: str | None = None) -> OpsiPackage:
+	"""
+	Returns the parsed opsi package.
+	Packages are cached by path and modification time, a changed file is parsed again.
+	"""
+	packageFile = packageFile.absolute()
+	return _parse_package(str(packageFile), packageFile.stat().st_mtime_ns, str(temp_dir) if temp_dir else None)
@@ -14,6 +14,7 @@ from __future__ import annotations
 import argparse
 import operator
 import sys
+from functools import cached_property
 from pathlib import Path
 
 from configupdater import ConfigUpdater
@@ -25,6 +26,7 @@ from opsicommon.logging import (
 	init_logging,
 	logging_config,
 )
+from opsicommon.objects import ProductOnDepot
 from opsicommon.system import ensure_not_already_running
 from opsicommon.types import forceProductId
 
@@ -51,6 +53,23 @@ class OpsiPackageUpdaterClient(OpsiPackageUpdater):
 	def __enter__(self) -> OpsiPackageUpdaterClient:
 		return self
 
+	@cached_property
+	def installedProductsById(self) -> dict[str, ProductOnDepot]:
+		"""
+		The installed products by product id, fetched once per client.
+		Only meant for listings, installing or updating does not refresh it.
+		"""
+		return {product.productId: product for product in self.getInstalledProducts()}
+
+	@cached_property
+	def installedVersionsById(self) -> dict[str, str]:
+		"""
+		The installed versions (<productVersion>-<packageVersion>) by product id.
+		"""
+		return {
+			productId: f"{product.productVersion}-{product.packageVersion}" for productId, product in self.installedProductsById.items()
+		}
+
 	def listActiveRepos(self) -> None:
 		logger.notice("Active repositories:")
 		for repository in sorted(self.getActiveRepositories(), key=lambda repo: repo.name.lower()):
@@ -77,13 +96,14 @@ class OpsiPackageUpdaterClient(OpsiPackageUpdater):
 		"""
 
 		data: dict[str, dict[str, str]] = {}
-		for repository in self.getActiveRepositories():
-			for package in self.getDownloadablePackagesFromRepository(repository):
+		for repository, packages in self.getDownloadablePackagesFromRepositories(list(self.getActiveRepositories())):
+			for package in packages:
 				name = str(package.get("productId"))
-				if name not in data or compareVersions(package.get("version"), ">", data[name].get("version")):
-					data[name] = {"version": str(package.get("version")), "repository": repository.name}
+				version = str(package.get("version"))
+				if name not in data or (version != data[name]["version"] and compareVersions(version, ">", data[name]["version"])):
+					data[name] = {"version": version, "repository": repository.name}
 
-		for name in sorted(data.keys()):
+		for name in sorted(data):
 			print(f"\t{name} (Version {data[name].get('version')} in {data[name].get('repository')})")
 
 	def listProductsInRepositories(self, withLocalInstallationStatus: bool = False, productId: str | None = None) -> None:
@@ -99,34 +119,35 @@ class OpsiPackageUpdaterClient(OpsiPackageUpdater):
 		:type productId: str
 		"""
 		if withLocalInstallationStatus:
-			localProducts = self.getInstalledProducts()
-			local_products_dict = {product.productId: product for product in localProducts}
+			localVersions = self.installedVersionsById
 
-		for repository in self.getActiveRepositories():
-			logger.notice("Packages in %s:", repository.name)
-			packages = sorted(self.getDownloadablePackagesFromRepository(repository), key=operator.itemgetter("productId"))
+		if productId:
+			productId = forceProductId(productId)
 
+		for repository, packages in self.getDownloadablePackagesFromRepositories(list(self.getActiveRepositories())):
+			logger.notice("Packages in %s:", repository.name)
 			if productId:
 				logger.debug("Filtering for product IDs matching %s...", productId)
-				productId = forceProductId(productId)
 				packages = [package for package in packages if productId in str(package["productId"])]
 
+			# Filter first, only the matching packages have to be sorted
+			packages = sorted(packages, key=operator.itemgetter("productId"))
+
+			lines = []
 			for package in packages:
 				if withLocalInstallationStatus:
-					try:
-						localProduct = local_products_dict[str(package["productId"])]
-					except KeyError as kerr:
-						logger.debug(kerr)
-						print(f"\t{package.get('productId')} (Version {package.get('version')}, not installed)")
-						continue
-
-					localVersion = f"{localProduct.productVersion}-{localProduct.packageVersion}"
-					if compareVersions(package["version"], "==", localVersion):
-						print(f"\t{package.get('productId')} (Version {package.get('version')}, installed)")
+					localVersion = localVersions.get(str(package["productId"]))
+					if localVersion is None:
+						lines.append(f"\t{package.get('productId')} (Version {package.get('version')}, not installed)\n")
+					elif versionsEqual(str(package["version"]), localVersion):
+						lines.append(f"\t{package.get('productId')} (Version {package.get('version')}, installed)\n")
 					else:
-						print(f"\t{package.get('productId')} (Version {package.get('version')}, installed {localVersion})")
+						lines.append(f"\t{package.get('productId')} (Version {package.get('version')}, installed {localVersion})\n")
 				else:
-					print(f"\t{package.get('productId')} (Version {package.get('version')})")
+					lines.append(f"\t{package.get('productId')} (Version {package.get('version')})\n")
+			# One write per repository instead of one print per package
+			sys.stdout.writelines(lines)
+			sys.stdout.flush()
 
 	def listProductsWithVersionDifference(self) -> None:
 		"""
@@ -136,19 +157,17 @@ class OpsiPackageUpdaterClient(OpsiPackageUpdater):
 		repository to the one locally installed and show if there is a
 		difference.
 		"""
-		localProducts = {product.productId: product for product in self.getInstalledProducts()}
+		localVersions = self.installedVersionsById
 
-		for repository in self.getActiveRepositories():
+		for repository, packages in self.getDownloadablePackagesFromRepositories(list(self.getActiveRepositories())):
 			repoMessageShown = False
-			packages = sorted(self.getDownloadablePackagesFromRepository(repository), key=lambda entry: str(entry["productId"]))
+			# Only products installed locally are compared
+			packages = sorted(
+				(package for package in packages if str(package["productId"]) in localVersions), key=lambda entry: str(entry["productId"])
+			)
 			for package in packages:
-				try:
-					localProduct = localProducts[str(package["productId"])]
-				except KeyError:
-					continue  # Not installed locally
-
-				localVersion = f"{localProduct.productVersion}-{localProduct.packageVersion}"
-				if not compareVersions(package["version"], "==", localVersion):
+				localVersion = localVersions[str(package["productId"])]
+				if not versionsEqual(str(package["version"]), localVersion):
 					if not repoMessageShown:
 						print(f"Packages in {repository.name}:")
 						repoMessageShown = True
@@ -163,13 +182,18 @@ class OpsiPackageUpdaterClient(OpsiPackageUpdater):
 			return
 
 		if updates:
-			for productId in sorted(updates.keys()):
+			for productId in sorted(updates):
 				up = updates[productId]
 				print(f"{up.get('productId')}: {up.get('newVersion')} in {up.get('repository')} (updatable from: {up.get('oldVersion')})")
 		else:
 			logger.notice("No updates found.")
 
 
+def versionsEqual(version: str, otherVersion: str) -> bool:
+	# Identical strings are the common case and need no parsing
+	return version == otherVersion or compareVersions(version, "==", otherVersion)
+
+
 parser = argparse.ArgumentParser(
 	description=(
 		"Updater for local opsi products.\n"
@@ -415,7 +439,9 @@ def updater_main() -> int:
 	config["ignoreErrors"] = args.ignoreErrors
 	config["useZsync"] = not args.no_zsync
 
-	ensure_not_already_running("opsi-package-updater")
+	if args.mode != "list":
+		# Listing is read-only and may run while packages are updated
+		ensure_not_already_running("opsi-package-updater")
 
 	with OpsiPackageUpdaterClient(config) as opu:
 		logger.info("Running in %s mode", args.mode)
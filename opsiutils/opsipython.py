@@ -6,10 +6,10 @@
 opsi-python interpreter for custom opsi python scripts
 """
 
-import argparse
 import os
 import sys
-import traceback
+from importlib.machinery import SourceFileLoader
+from importlib.util import cache_from_source
 
 import OPSI.Backend.Manager._Manager  # type: ignore[import]
 import opsicommon.client.opsiservice
@@ -38,9 +38,22 @@ def run_script() -> None:
 	new_module = imp_new_module(script)
 	new_module.__dict__["__name__"] = "__main__"
 	new_module.__dict__["__file__"] = script
-
-	with open(script, "r", encoding="utf-8") as file:
-		code = file.read()
+	new_module.__dict__["__cached__"] = None
+
+	if script.endswith(".py"):
+		# The loader reuses and writes the bytecode cache (__pycache__) like for imported modules
+		loader = SourceFileLoader("__main__", script)
+		new_module.__dict__["__loader__"] = loader
+		code = loader.get_code("__main__")
+		if code is None:
+			raise ImportError(f"Failed to load script {script!r}")
+		cached = cache_from_source(script)
+		if os.path.exists(cached):
+			new_module.__dict__["__cached__"] = cached
+	else:
+		# No valid cache file name can be derived without .py extension, compile without caching
+		with open(script, "r", encoding="utf-8") as file:
+			code = compile(file.read(), script, "exec")
 
 	add_systempackages_to_path()
 	exec(code, new_module.__dict__)
@@ -50,11 +63,18 @@ def run_interactive() -> None:
 	import code
 
 	add_systempackages_to_path()
-	code.interact(local=locals())
+	code.interact(local={"__name__": "__main__", "__doc__": None})
 
 
 def main() -> None:
 	try:
+		# Running a script is the common case, it does not need the argument parser
+		if len(sys.argv) > 1 and not sys.argv[1].startswith("-"):
+			run_script()
+			return
+
+		import argparse
+
 		parser = argparse.ArgumentParser(add_help=False)
 		parser.add_argument("-V", "--version", action="store_true", help="print the Python version number and exit")
 		parser.add_argument("-h", "--help", action="store_true", help="print this help message and exit")
@@ -83,5 +103,7 @@ def main() -> None:
 
 		run_interactive()
 	except Exception:
+		import traceback
+
 		traceback.print_exc()
 		sys.exit(1)
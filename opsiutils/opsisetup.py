@@ -21,7 +21,6 @@ from opsicommon.logging import (
 	logger,
 	logging_config,
 )
-from opsicommon.server.rights import set_rights
 from opsicommon.types import forceFilename
 
 from opsiutils import __version__
@@ -164,6 +163,8 @@ def opsisetup_main():
 			raise RuntimeError("Too many arguments")
 
 	if task == "set-rights":
+		from opsicommon.server.rights import set_rights
+
 		set_rights(path)
 
 
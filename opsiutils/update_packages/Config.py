@@ -47,6 +47,7 @@ DEFAULT_CONFIG: dict[str, str | int | bool | list[ProductRepositoryInfo] | None]
 	"packageDir": "/var/lib/opsi/products",
 	"configFile": "/etc/opsi/opsi-package-updater.conf",
 	"repositoryConfigDir": "/etc/opsi/package-updater.repos.d",
+	"metafileCacheDir": None,
 	"notification": False,
 	"smtphost": "localhost",
 	"smtpport": 25,
@@ -147,6 +148,8 @@ class ConfigurationParser:
 							config["tempdir"] = value.strip()
 						elif option.lower() == "repositoryconfigdir":
 							config["repositoryConfigDir"] = value.strip()
+						elif option.lower() == "metafilecachedir":
+							config["metafileCacheDir"] = forceFilename(value.strip()) if value.strip() else None
 						elif option.lower() == "proxy" and value.strip():
 							config["proxy"] = value.strip()
 							if config["proxy"] != "system":
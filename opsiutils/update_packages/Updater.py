@@ -10,10 +10,13 @@ Component for handling package updates.
 from __future__ import annotations
 
 import datetime
+import hashlib
+import json
 import os
 import os.path
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from pathlib import Path, PurePosixPath
 from traceback import TracebackException
@@ -63,6 +66,8 @@ __all__ = ("OpsiPackageUpdater",)
 
 logger = get_logger("opsi.general")
 
+MAX_PARALLEL_REPOSITORY_FETCHES = 8
+
 
 class HashsumMissmatchError(ValueError):
 	pass
@@ -111,6 +116,7 @@ class OpsiPackageUpdater:
 		self.isConfigServer = OpsiConfig().get("host", "server-role") == "configserver"
 		self.errors: list[Exception] = []
 		self.metafile_cache: dict[str, bytes | None] = {}
+		self.repository_packages_cache: dict[str, list[dict[str, str | ProductRepositoryInfo | None]]] = {}
 
 		# Proxy is needed for getConfigBackend which is needed for ConfigurationParser.parse
 		self.config["proxy"] = ConfigurationParser.get_proxy(str(self.config["configFile"]))
@@ -1182,15 +1188,27 @@ class OpsiPackageUpdater:
 
 	def getDownloadablePackages(self) -> list[dict[str, str | ProductRepositoryInfo | None]]:
 		downloadablePackages = []
-		for repository in self.getActiveRepositories():
+		for _repository, packages in self.getDownloadablePackagesFromRepositories(list(self.getActiveRepositories())):
+			downloadablePackages.extend(packages)
+		return downloadablePackages
+
+	def getDownloadablePackagesFromRepositories(
+		self, repositories: list[ProductRepositoryInfo]
+	) -> list[tuple[ProductRepositoryInfo, list[dict[str, str | ProductRepositoryInfo | None]]]]:
+		"""
+		Fetches the package infos of the repositories concurrently.
+		The result keeps the order of `repositories`.
+		"""
+		for repository in repositories:
 			logger.info(
 				"Getting package infos from repository '%s' (%s)",
 				repository.name,
 				repository.baseUrl,
 			)
-			for package in self.getDownloadablePackagesFromRepository(repository):
-				downloadablePackages.append(package)
-		return downloadablePackages
+		if not repositories:
+			return []
+		with ThreadPoolExecutor(max_workers=min(len(repositories), MAX_PARALLEL_REPOSITORY_FETCHES)) as executor:
+			return list(zip(repositories, executor.map(self.getDownloadablePackagesFromRepository, repositories)))
 
 	def read_repository_metafile(
 		self, repository: ProductRepositoryInfo, data: bytes
@@ -1226,20 +1244,75 @@ class OpsiPackageUpdater:
 			packages.append(pdict)
 		return packages
 
+	def get_metafile_cache_files(self, url: str) -> tuple[Path, Path] | None:
+		"""
+		Returns the data and validator file of the disk cache for the metafile url.
+		Returns `None` if no cache directory is configured.
+		"""
+		cache_dir = self.config.get("metafileCacheDir")
+		if not cache_dir:
+			return None
+		name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+		return Path(str(cache_dir)) / f"{name}.data", Path(str(cache_dir)) / f"{name}.json"
+
 	def fetch_repository_metafile(self, session: Session, url: str) -> bytes | None:
 		if url not in self.metafile_cache:
 			logger.info("Trying to fetch repository metafile: %s", url)
-			response = session.get(url)
-			if response.status_code == 200:
+			headers = {}
+			cached_data = None
+			cache_files = self.get_metafile_cache_files(url)
+			if cache_files:
+				try:
+					validators = json.loads(cache_files[1].read_text(encoding="utf-8"))
+					cached_data = cache_files[0].read_bytes()
+				except (OSError, ValueError):
+					pass
+				else:
+					if validators.get("etag"):
+						headers["If-None-Match"] = validators["etag"]
+					if validators.get("last_modified"):
+						headers["If-Modified-Since"] = validators["last_modified"]
+
+			response = session.get(url, headers=headers)
+			if response.status_code == 304 and cached_data is not None:
+				logger.notice("Repository metafile not modified, using cached metafile: %s", url)
+				self.metafile_cache[url] = cached_data
+			elif response.status_code == 200:
 				logger.notice("Repository metafile successfully fetched: %s", url)
 				self.metafile_cache[url] = response.content
+				if cache_files:
+					self.write_metafile_cache(cache_files, response)
 			else:
 				self.metafile_cache[url] = None
 		return self.metafile_cache[url]
 
+	def write_metafile_cache(self, cache_files: tuple[Path, Path], response: Response) -> None:
+		validators = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+		if not any(validators.values()):
+			# Without validators a cached metafile can never be revalidated
+			return
+		data_file, validator_file = cache_files
+		try:
+			data_file.parent.mkdir(parents=True, exist_ok=True)
+			# Validators are written last, they must never belong to another data file
+			validator_file.unlink(missing_ok=True)
+			data_file.write_bytes(response.content)
+			validator_file.write_text(json.dumps(validators), encoding="utf-8")
+		except OSError as err:
+			logger.warning("Failed to cache repository metafile in '%s': %s", data_file.parent, err)
+
 	def getDownloadablePackagesFromRepository(
 		self, repository: ProductRepositoryInfo
 	) -> list[dict[str, str | ProductRepositoryInfo | None]]:
+		"""
+		Returns the package infos of the repository.
+		The repository is only scanned once per updater instance.
+		"""
+		if repository.name not in self.repository_packages_cache:
+			self.repository_packages_cache[repository.name] = self.fetch_repository_packages(repository)
+		return list(self.repository_packages_cache[repository.name])
+
+	def fetch_repository_packages(self, repository: ProductRepositoryInfo) -> list[dict[str, str | ProductRepositoryInfo | None]]:
 		with self.makeSession(repository) as session:
 			for meta_file in (
 				"packages.msgpack.zstd",
@@ -0,0 +1,120 @@
+"""
+opsi-utils
+
+tests for opsi-package-manager
+"""
+
+import hashlib
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+from unittest import mock
+
+from opsiutils.opsipackagemanager import OpsiPackageManager, filter_product_ids, sort_package_files_by_dependencies
+
+
+def _package(product_id: str, dependencies: list[str] | None = None) -> Any:
+	return SimpleNamespace(
+		product=SimpleNamespace(id=product_id),
+		package_dependencies=[SimpleNamespace(package=dependency) for dependency in dependencies or []],
+	)
+
+
+def test_sort_package_files_by_dependencies() -> None:
+	packages = {
+		"a.opsi": _package("a", ["c"]),
+		"b.opsi": _package("b"),
+		"c.opsi": _package("c", ["d", "unknown"]),
+		"d.opsi": _package("d"),
+	}
+	assert sort_package_files_by_dependencies(packages) == ["d.opsi", "c.opsi", "a.opsi", "b.opsi"]
+
+
+def test_sort_package_files_keeps_order_without_dependencies() -> None:
+	packages = {"c.opsi": _package("c"), "a.opsi": _package("a"), "b.opsi": _package("b")}
+	assert sort_package_files_by_dependencies(packages) == ["c.opsi", "a.opsi", "b.opsi"]
+
+
+def test_sort_package_files_circular_dependencies() -> None:
+	packages = {
+		"x.opsi": _package("x"),
+		"a.opsi": _package("a", ["b"]),
+		"b.opsi": _package("b", ["a"]),
+	}
+	assert sort_package_files_by_dependencies(packages) == ["x.opsi", "b.opsi", "a.opsi"]
+
+
+def test_filter_product_ids() -> None:
+	product_ids = ["firefox", "firefox-esr", "7zip", "opsi-script", "opsi_script"]
+	assert filter_product_ids(product_ids, "firefox") == ["firefox"]
+	assert filter_product_ids(product_ids, "Firefox") == ["firefox"]
+	assert filter_product_ids(product_ids, "FIRE*") == ["firefox", "firefox-esr"]
+	assert filter_product_ids(product_ids, "*zip") == ["7zip"]
+	assert filter_product_ids(product_ids, "*") == product_ids
+	assert filter_product_ids(product_ids, "opsi?script") == []
+	assert filter_product_ids(product_ids, "[7]zip") == []
+	assert filter_product_ids(product_ids, "fire") == []
+
+
+def test_filter_product_ids_special_characters() -> None:
+	# Only * is a wildcard for the backend, ? and [...] are matched literally
+	product_ids = ["test[1]", "test1", "test?", "testa"]
+	assert filter_product_ids(product_ids, "test[1]") == ["test[1]"]
+	assert filter_product_ids(product_ids, "test[a1]") == []
+	assert filter_product_ids(product_ids, "test?") == ["test?"]
+	assert filter_product_ids(product_ids, "TEST[*") == ["test[1]"]
+
+
+def _package_manager(depot_id: str, package_file: Path, repository_content: list[dict[str, Any]]) -> Any:
+	config = {
+		"quiet": True,
+		"depotIds": [depot_id],
+		"localDepotId": "config.test.local",
+		"maxTransfers": 0,
+		"overwriteAlways": False,
+		"deltaUpload": True,
+		"deltaMinSize": 32768,
+	}
+	package_manager = OpsiPackageManager(config, mock.MagicMock())
+	package_manager.productPackageFiles[package_file.name] = _package("test")
+	package_manager.depotObjects[depot_id] = SimpleNamespace(repositoryLocalUrl="file:///var/lib/opsi/repository/")
+
+	repository = mock.MagicMock()
+	repository.content.return_value = repository_content
+	package_manager.depotRepositories[depot_id] = repository
+
+	depot_connection = mock.MagicMock()
+	depot_connection.depot_getDiskSpaceUsage.return_value = {"available": 1024 * 1024 * 1024, "usage": 0.1}
+	depot_connection.depot_getMD5Sum.return_value = hashlib.md5(package_file.read_bytes()).hexdigest()
+	package_manager.depotConnections[depot_id] = depot_connection
+	return package_manager
+
+
+def test_upload_to_repository(tmp_path: Path) -> None:
+	depot_id = "depot.test.local"
+	package_file = tmp_path / "test_1.0-1.opsi"
+	package_file.write_bytes(b"opsi package")
+	package_manager = _package_manager(depot_id, package_file, [{"name": "test_0.9-1.opsi", "size": 10}])
+
+	package_manager.uploadToRepository(str(package_file), depot_id)
+
+	repository = package_manager.depotRepositories[depot_id]
+	repository.upload.assert_called_once_with(str(package_file), "test_1.0-1.opsi", mock.ANY)
+	repository.delete.assert_called_once_with("test_0.9-1.opsi")
+	depot_connection = package_manager.depotConnections[depot_id]
+	depot_connection.depot_createMd5SumFile.assert_called_once_with(
+		"/var/lib/opsi/repository/test_1.0-1.opsi", "/var/lib/opsi/repository/test_1.0-1.opsi.md5"
+	)
+	assert package_manager.getRunningTransfers() == 0
+
+
+def test_upload_to_repository_up_to_date(tmp_path: Path) -> None:
+	depot_id = "depot.test.local"
+	package_file = tmp_path / "test_1.0-1.opsi"
+	package_file.write_bytes(b"opsi package")
+	package_manager = _package_manager(depot_id, package_file, [{"name": "test_1.0-1.opsi", "size": package_file.stat().st_size}])
+
+	package_manager.uploadToRepository(str(package_file), depot_id)
+
+	package_manager.depotRepositories[depot_id].upload.assert_not_called()
+	assert package_manager.getRunningTransfers() == 0
@@ -348,6 +348,92 @@ def test_server_repo_meta_multiurl(  # pylint: disable=redefined-outer-name,too-
 		assert available_packages[0]["zsyncFile"] is None
 
 
+def test_server_repo_meta_cache_not_modified(  # pylint: disable=redefined-outer-name
+	tmp_path: Path, package_updater_class: type[OpsiPackageUpdater]
+) -> None:
+	updater_info = prepare_updater(tmp_path)
+	updater_info.config["metafileCacheDir"] = str(tmp_path / "metafile-cache")
+
+	rmpc = RepoMetaPackageCollection()
+	rmpc.scan_packages(updater_info.server_dir)
+	rmpc.write_metafile(updater_info.server_dir / "packages.msgpack.zstd")
+
+	with http_test_server(serve_directory=updater_info.server_dir, log_file=str(updater_info.server_log)) as server:
+		write_repo_conf(updater_info.test_repo_conf, f"http://localhost:{server.port}")
+
+		package_updater = package_updater_class(updater_info.config)  # type: ignore[arg-type]
+		assert len(package_updater.getDownloadablePackages()) == 4
+		# A new updater instance revalidates the cached metafile
+		package_updater = package_updater_class(updater_info.config)  # type: ignore[arg-type]
+		assert len(package_updater.getDownloadablePackages()) == 4
+
+		requests = [json.loads(line) for line in updater_info.server_log.read_text(encoding="utf-8").rstrip().split("\n")]
+		assert len(requests) == 2
+		assert "If-Modified-Since" not in requests[0]["headers"]
+		assert requests[1]["path"] == "/packages.msgpack.zstd"
+		assert "If-Modified-Since" in requests[1]["headers"]
+
+
+def _metafile_response(status_code: int, content: bytes = b"", headers: dict[str, str] | None = None) -> mock.MagicMock:
+	return mock.MagicMock(status_code=status_code, content=content, headers=headers or {})
+
+
+def _fetch_metafile(
+	config: dict[str, Any], package_updater_class: type[OpsiPackageUpdater], response: mock.MagicMock
+) -> tuple[bytes | None, dict]:
+	session = mock.MagicMock()
+	session.get.return_value = response
+	package_updater = package_updater_class(config)  # type: ignore[arg-type]
+	data = package_updater.fetch_repository_metafile(session, "http://localhost/packages.json")
+	return data, session.get.call_args.kwargs["headers"]
+
+
+def test_metafile_cache_etag(tmp_path: Path, package_updater_class: type[OpsiPackageUpdater]) -> None:  # pylint: disable=redefined-outer-name
+	updater_info = prepare_updater(tmp_path, copy_files=False)
+	updater_info.config["metafileCacheDir"] = str(tmp_path / "metafile-cache")
+
+	data, headers = _fetch_metafile(updater_info.config, package_updater_class, _metafile_response(200, b"metafile", {"ETag": '"v1"'}))
+	assert data == b"metafile"
+	assert headers == {}
+
+	data, headers = _fetch_metafile(updater_info.config, package_updater_class, _metafile_response(304))
+	assert data == b"metafile"
+	assert headers == {"If-None-Match": '"v1"'}
+
+
+def test_metafile_cache_without_validators(tmp_path: Path, package_updater_class: type[OpsiPackageUpdater]) -> None:  # pylint: disable=redefined-outer-name
+	updater_info = prepare_updater(tmp_path, copy_files=False)
+	cache_dir = tmp_path / "metafile-cache"
+	updater_info.config["metafileCacheDir"] = str(cache_dir)
+
+	data, _ = _fetch_metafile(updater_info.config, package_updater_class, _metafile_response(200, b"metafile"))
+	assert data == b"metafile"
+	assert not cache_dir.exists() or not list(cache_dir.iterdir())
+
+
+@pytest.mark.parametrize("validator_data", (None, "{invalid"))
+def test_metafile_cache_invalid_validators(  # pylint: disable=redefined-outer-name
+	tmp_path: Path, package_updater_class: type[OpsiPackageUpdater], validator_data: str | None
+) -> None:
+	updater_info = prepare_updater(tmp_path, copy_files=False)
+	cache_dir = tmp_path / "metafile-cache"
+	updater_info.config["metafileCacheDir"] = str(cache_dir)
+
+	_fetch_metafile(
+		updater_info.config, package_updater_class, _metafile_response(200, b"metafile", {"Last-Modified": "Fri, 16 Oct 2026 12:00:00 GMT"})
+	)
+	validator_files = list(cache_dir.glob("*.json"))
+	assert len(validator_files) == 1
+	if validator_data is None:
+		validator_files[0].unlink()
+	else:
+		validator_files[0].write_text(validator_data, encoding="utf-8")
+
+	data, headers = _fetch_metafile(updater_info.config, package_updater_class, _metafile_response(200, b"new metafile"))
+	assert data == b"new metafile"
+	assert headers == {}
+
+
 @pytest.mark.parametrize(
 	"source, name, correct_result",
 	(